@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from fake_roblox import FakeRoblox
+
+# Offline benchmark of the ranking bot against the fake Roblox API in fake_roblox.py.
+# main.py reads its config at import time, so it is imported only after a throwaway
+# config pointing every Roblox API at the fake server has been written.
+
+class FakeMessage:
+    def __init__(self, content=None, embed=None, view=None):
+        self.content = content
+        self.embed = embed
+        self.view = view
+
+    async def edit(self, content=None, embed=None, view=None, **kwargs):
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, **kwargs):
+        self.interaction.deferred_at = time.perf_counter()
+
+    async def send_message(self, content=None, **kwargs):
+        self.interaction.messages.append(FakeMessage(content, kwargs.get('embed'), kwargs.get('view')))
+
+    async def edit_message(self, content=None, **kwargs):
+        self.interaction.messages.append(FakeMessage(content, kwargs.get('embed'), kwargs.get('view')))
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, embed=None, view=None, **kwargs):
+        message = FakeMessage(content, embed, view)
+        self.interaction.messages.append(message)
+        return message
+
+class FakeInteraction:
+    """Just enough of discord.Interaction for the command handlers in main.py"""
+
+    def __init__(self, discord):
+        self.user = SimpleNamespace(id=1, name="benchmark")
+        self.guild = None
+        self.guild_id = None
+        self.command = None
+        self.created_at = discord.utils.utcnow()
+        self.deferred_at = None
+        self.messages = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+async def measure(name, operations, concurrency):
+    """Run coroutine factories with bounded concurrency and summarise their latency"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def run(operation):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await operation()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(operation) for operation in operations))
+    elapsed = time.perf_counter() - started
+    return {
+        'name': name,
+        'ops': len(latencies),
+        'errors': errors,
+        'elapsed': elapsed,
+        'ops_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0
+    }
+
+def write_config(workdir, base_url, args):
+    bucket = {"rate": 5, "burst": 10} if args.realistic_rate_limits else {"rate": 100000, "burst": 100000}
+    config = {
+        "token": None,
+        "cookie": "benchmark",
+        "group_id": 1,
+        "roles": {"ranking_permit": 1, "developer": 1, "suspension_permit": 1},
+        "suspension_rank_name": "Customer",
+        "state_db": os.path.join(workdir, "state.db"),
+        "audit_log": {"directory": os.path.join(workdir, "audit")},
+        "api_urls": {"auth": base_url, "users": base_url, "groups": base_url},
+        "rate_limits": {
+            "buckets": {"auth": bucket, "users": bucket, "groups": bucket},
+            "max_retries": 6,
+            "backoff_base": 0.05,
+            "backoff_max": 2
+        },
+        "restores": {"concurrency": args.concurrency, "retry_base": 0.1, "retry_max": 2},
+        "bulk_rank": {"max_users": args.ops, "concurrency": args.concurrency},
+        "metrics": {"enabled": False}
+    }
+    path = os.path.join(workdir, "config.json")
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=4)
+    return path
+
+async def wait_for_restores(pipeline, expected, timeout):
+    deadline = time.perf_counter() + timeout
+    while pipeline.restored < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+async def run_benchmark(args):
+    fake = FakeRoblox(
+        user_count=args.users,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        csrf_rotate_every=args.csrf_rotate_every
+    )
+    base_url = await fake.start()
+    workdir = tempfile.mkdtemp(prefix="rankbot-bench-")
+    os.environ['CONFIG_PATH'] = write_config(workdir, base_url, args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main = importlib.import_module('main')
+    import discord
+    logging.getLogger('roblox-ranking-bot').setLevel(args.log_level)
+
+    bot = main.bot
+    api = bot.roblox_api
+    results = []
+    try:
+        startup_started = time.perf_counter()
+        await api.initialize()
+        print(f"Initialized against {base_url} in {(time.perf_counter() - startup_started) * 1000:.1f}ms")
+
+        ops = min(args.ops, args.users)
+        names = [f"User{user_id}" for user_id in range(1, ops + 1)]
+        user_ids = list(range(1, ops + 1))
+        group = api.groups[main.MAIN_GROUP]
+        top_role = group.roles.sorted[-1]
+
+        # Roblox API wrapper
+        results.append(await measure(
+            "get_user_info (cold)", [lambda name=name: api.get_user_info(name) for name in names], args.concurrency
+        ))
+        results.append(await measure(
+            "get_user_info (cached)", [lambda name=name: api.get_user_info(name) for name in names], args.concurrency
+        ))
+        api.user_cache.clear()
+        results.append(await measure(
+            "get_user_info (coalesced)", [lambda: api.get_user_info(names[0]) for _ in names], args.concurrency
+        ))
+        results.append(await measure(
+            "get_user_rank", [lambda user_id=user_id: group.get_user_rank(user_id) for user_id in user_ids], args.concurrency
+        ))
+        results.append(await measure(
+            "set_rank", [lambda user_id=user_id: group.set_rank(user_id, top_role['id']) for user_id in user_ids], args.concurrency
+        ))
+        results.append(await measure(
+            "get_users_info (batched)", [lambda: api.get_users_info([str(user_id) for user_id in user_ids])], 1
+        ))
+        results[-1]['name'] += f" x{ops}"
+
+        # Command handlers, called past the permission check
+        get_rank = main.get_rank.callback.__wrapped__
+        suspend = main.suspend_user.callback.__wrapped__
+        results.append(await measure(
+            "/getrank handler",
+            [lambda name=name: get_rank(FakeInteraction(discord), name) for name in names],
+            args.concurrency
+        ))
+        results.append(await measure(
+            "/suspend handler",
+            [lambda name=name: suspend(FakeInteraction(discord), name, "1s") for name in names],
+            args.concurrency
+        ))
+
+        # /getrank while a background flood of rank changes holds the rate limiters; the flood
+        # runs at background priority, so with --realistic-rate-limits the handler should
+        # keep close to its unloaded latency
+        async def interactive(operation):
+            main.request_priority.set('interactive')
+            await operation()
+        flood = asyncio.ensure_future(measure(
+            "set_rank (background flood)",
+            [lambda user_id=user_id: group.set_rank(user_id, top_role['id']) for user_id in user_ids * 3],
+            args.concurrency
+        ))
+        await asyncio.sleep(0)
+        results.append(await measure(
+            "/getrank handler (during flood)",
+            [lambda name=name: interactive(lambda: get_rank(FakeInteraction(discord), name)) for name in names[:20]],
+            1
+        ))
+        results.append(await flood)
+        
+        # Expiry sweep: every suspension above ends after one second
+        bot.restore_pipeline.start()
+        suspended = (await bot.store.counts())['suspensions']
+        await asyncio.sleep(1.1)
+        sweep_started = time.perf_counter()
+        await bot.check_expirations()
+        sweep_elapsed = time.perf_counter() - sweep_started
+        await wait_for_restores(bot.restore_pipeline, suspended, timeout=max(30, suspended))
+        drain_elapsed = time.perf_counter() - sweep_started
+        restored = bot.restore_pipeline.restored
+        results.append({
+            'name': f"expiry sweep + restore x{suspended}",
+            'ops': restored,
+            'errors': suspended - restored,
+            'elapsed': drain_elapsed,
+            'ops_per_sec': restored / drain_elapsed if drain_elapsed else 0.0,
+            'p50_ms': sweep_elapsed * 1000,
+            'p99_ms': sweep_elapsed * 1000,
+            'mean_ms': sweep_elapsed * 1000
+        })
+    finally:
+        bot.restore_pipeline.stop()
+        await api.close()
+        bot.store.close()
+        bot.audit_log.close()
+        await fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results, fake, api)
+
+def print_report(results, fake, api):
+    print()
+    print(f"{'scenario':<40} {'ops':>7} {'errors':>7} {'ops/sec':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        print(
+            f"{result['name']:<40} {result['ops']:>7} {result['errors']:>7} {result['ops_per_sec']:>10.1f} "
+            f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}"
+        )
+    print()
+    print("(expiry sweep p50/p99 show the time to queue every expired suspension; ops/sec covers the full restore)")
+    print(f"Fake server: {fake.stats()}")
+    print(f"User cache: {api.user_cache.stats()}")
+    print(f"CSRF rotations: {api.csrf_rotations}")
+    print(f"Rate limits: {api.rate_limit_state()}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the ranking bot against a local fake Roblox API")
+    parser.add_argument('--users', type=int, default=1000, help="Number of users in the fake group")
+    parser.add_argument('--ops', type=int, default=500, help="Operations per scenario")
+    parser.add_argument('--concurrency', type=int, default=50, help="Operations in flight at once")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds of latency added by the fake server")
+    parser.add_argument('--latency-jitter', type=float, default=0.01, help="Extra random latency in seconds")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--csrf-rotate-every', type=float, default=None, help="Seconds between CSRF token rotations")
+    parser.add_argument('--log-level', default='WARNING', help="Log level for the bot while benchmarking")
+    parser.add_argument(
+        '--realistic-rate-limits', action='store_true',
+        help="Use the bot's default token bucket sizes instead of effectively unlimited ones"
+    )
+    return parser
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark(build_parser().parse_args()))
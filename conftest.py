@@ -0,0 +1,20 @@
+import json
+import os
+import tempfile
+
+# main.py reads its config and creates the bot at import time, so every test module imports
+# it only after this throwaway config has been put in place
+
+_directory = tempfile.mkdtemp(prefix='ranking-bot-tests-')
+_config_path = os.path.join(_directory, 'config.json')
+with open(_config_path, 'w') as f:
+    json.dump({
+        "token": None,
+        "cookie": "test",
+        "group_id": 1,
+        "roles": {},
+        "state_db": os.path.join(_directory, 'state.db'),
+        "metrics": {"enabled": False},
+        "audit_log": {"directory": os.path.join(_directory, 'audit')}
+    }, f)
+os.environ['CONFIG_PATH'] = _config_path
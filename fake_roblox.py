@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import logging
+import random
+import secrets
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('fake-roblox')
+
+# Local stand-in for the Roblox auth, users and groups APIs used by RobloxAPI.
+# Every API family is served from the same base URL, so point all of "api_urls" at it.
+class FakeRoblox:
+    """In-memory fake of the Roblox endpoints the bot uses, with injectable faults"""
+
+    def __init__(self, group_id=1, user_count=1000, role_count=30, latency=0.0, latency_jitter=0.0,
+                 rate_429=0.0, rate_5xx=0.0, csrf_rotate_every=None, page_size=100):
+        self.group_id = group_id
+        self.latency = latency  # Seconds added to every response
+        self.latency_jitter = latency_jitter  # Extra random latency of up to this many seconds
+        self.rate_429 = rate_429  # Fraction of requests answered with 429
+        self.rate_5xx = rate_5xx  # Fraction of requests answered with 503
+        self.csrf_rotate_every = csrf_rotate_every  # Seconds between CSRF token rotations
+        self.page_size = page_size
+
+        self.csrf_token = secrets.token_hex(8)
+        self.csrf_issued_at = time.monotonic()
+        self.shout = ""
+
+        # Guest (rank 0) plus role_count ranked roles
+        self.roles = [{"id": 1000, "name": "Guest", "rank": 0}]
+        self.roles.append({"id": 1001, "name": "Customer", "rank": 1})
+        for index in range(2, role_count + 1):
+            self.roles.append({"id": 1000 + index, "name": f"Rank {index}", "rank": index * 5})
+        self.roles_by_id = {role['id']: role for role in self.roles}
+
+        self.users = {user_id: f"User{user_id}" for user_id in range(1, user_count + 1)}
+        self.user_ids_by_name = {name.lower(): user_id for user_id, name in self.users.items()}
+        # Every user starts as a member, spread over the non-guest roles
+        ranked_roles = [role['id'] for role in self.roles if role['rank'] > 0]
+        self.members = {user_id: ranked_roles[user_id % len(ranked_roles)] for user_id in self.users}
+
+        self.requests = 0
+        self.injected_429 = 0
+        self.injected_5xx = 0
+        self.csrf_rejections = 0
+        self._runner = None
+
+    def app(self):
+        app = web.Application(middlewares=[self.fault_middleware])
+        app.router.add_post('/v2/logout', self.logout)
+        app.router.add_get('/v1/users/authenticated', self.authenticated_user)
+        app.router.add_get('/v1/users/{user_id:\\d+}', self.get_user)
+        app.router.add_post('/v1/users', self.get_users)
+        app.router.add_post('/v1/usernames/users', self.get_usernames)
+        app.router.add_get('/v1/groups/{group_id:\\d+}/roles', self.get_roles)
+        app.router.add_get('/v1/groups/{group_id:\\d+}/roles/{role_id:\\d+}/users', self.get_role_members)
+        app.router.add_get('/v2/users/{user_id:\\d+}/groups/roles', self.get_user_groups)
+        app.router.add_patch('/v1/groups/{group_id:\\d+}/users/{user_id:\\d+}', self.set_rank)
+        app.router.add_patch('/v1/groups/{group_id:\\d+}/status', self.set_status)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start serving and return the base URL"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'injected_429': self.injected_429,
+            'injected_5xx': self.injected_5xx,
+            'csrf_rejections': self.csrf_rejections
+        }
+
+    # Fault injection
+    @web.middleware
+    async def fault_middleware(self, request, handler):
+        self.requests += 1
+        delay = self.latency + random.uniform(0, self.latency_jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        roll = random.random()
+        if roll < self.rate_429:
+            self.injected_429 += 1
+            return web.json_response(
+                {"errors": [{"code": 0, "message": "Too many requests"}]},
+                status=429,
+                headers={'Retry-After': '1'}
+            )
+        if roll < self.rate_429 + self.rate_5xx:
+            self.injected_5xx += 1
+            return web.json_response({"errors": [{"code": 0, "message": "Service unavailable"}]}, status=503)
+
+        if self.csrf_rotate_every and time.monotonic() - self.csrf_issued_at >= self.csrf_rotate_every:
+            self.rotate_csrf()
+        return await handler(request)
+
+    def rotate_csrf(self):
+        self.csrf_token = secrets.token_hex(8)
+        self.csrf_issued_at = time.monotonic()
+
+    def check_csrf(self, request):
+        """Return a 403 response if the request doesn't carry the current CSRF token"""
+        if request.headers.get('X-CSRF-TOKEN') == self.csrf_token:
+            return None
+        self.csrf_rejections += 1
+        return web.json_response(
+            {"errors": [{"code": 0, "message": "Token Validation Failed"}]},
+            status=403,
+            headers={'x-csrf-token': self.csrf_token}
+        )
+
+    # Auth
+    async def logout(self, request):
+        return web.json_response(
+            {"errors": [{"code": 0, "message": "Token Validation Failed"}]},
+            status=403,
+            headers={'x-csrf-token': self.csrf_token}
+        )
+
+    # Users
+    async def authenticated_user(self, request):
+        return web.json_response({"id": 1, "name": "FakeRankingBot", "displayName": "FakeRankingBot"})
+
+    async def get_user(self, request):
+        user_id = int(request.match_info['user_id'])
+        if user_id not in self.users:
+            return web.json_response({"errors": [{"code": 3, "message": "The user id is invalid."}]}, status=404)
+        return web.json_response({"id": user_id, "name": self.users[user_id], "displayName": self.users[user_id]})
+
+    async def get_users(self, request):
+        body = await request.json()
+        return web.json_response({"data": [
+            {"id": user_id, "name": self.users[user_id], "displayName": self.users[user_id]}
+            for user_id in body.get('userIds', [])[:100]
+            if user_id in self.users
+        ]})
+
+    async def get_usernames(self, request):
+        body = await request.json()
+        data = []
+        for username in body.get('usernames', [])[:100]:
+            user_id = self.user_ids_by_name.get(username.lower())
+            if user_id is not None:
+                data.append({
+                    "requestedUsername": username,
+                    "id": user_id,
+                    "name": self.users[user_id],
+                    "displayName": self.users[user_id]
+                })
+        return web.json_response({"data": data})
+
+    # Groups
+    async def get_roles(self, request):
+        member_counts = Counter(self.members.values())
+        return web.json_response({
+            "groupId": self.group_id,
+            "roles": [{**role, "memberCount": member_counts[role['id']]} for role in self.roles]
+        })
+
+    async def get_role_members(self, request):
+        role_id = int(request.match_info['role_id'])
+        limit = min(int(request.query.get('limit', self.page_size)), 100)
+        start = int(request.query.get('cursor') or 0)
+        members = sorted(user_id for user_id, member_role in self.members.items() if member_role == role_id)
+        page = members[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(members) else None
+        return web.json_response({
+            "previousPageCursor": str(max(0, start - limit)) if start else None,
+            "nextPageCursor": next_cursor,
+            "data": [{"userId": user_id, "username": self.users[user_id]} for user_id in page]
+        })
+
+    async def get_user_groups(self, request):
+        user_id = int(request.match_info['user_id'])
+        role_id = self.members.get(user_id)
+        data = []
+        if role_id is not None:
+            data.append({
+                "group": {"id": self.group_id, "name": "Fake Group"},
+                "role": self.roles_by_id[role_id]
+            })
+        return web.json_response({"data": data})
+
+    async def set_rank(self, request):
+        rejection = self.check_csrf(request)
+        if rejection:
+            return rejection
+        user_id = int(request.match_info['user_id'])
+        body = await request.json()
+        if user_id not in self.members:
+            return web.json_response({"errors": [{"code": 3, "message": "The user is invalid or does not exist."}]}, status=400)
+        if body.get('roleId') not in self.roles_by_id:
+            return web.json_response({"errors": [{"code": 2, "message": "The roleset is invalid or does not exist."}]}, status=400)
+        self.members[user_id] = body['roleId']
+        return web.json_response({})
+
+    async def set_status(self, request):
+        rejection = self.check_csrf(request)
+        if rejection:
+            return rejection
+        body = await request.json()
+        self.shout = body.get('message', '')
+        return web.json_response({"body": self.shout})
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run a local fake of the Roblox APIs used by the ranking bot")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--group-id', type=int, default=1)
+    parser.add_argument('--users', type=int, default=1000, help="Number of fake users, all group members")
+    parser.add_argument('--roles', type=int, default=30, help="Number of ranked roles besides Guest")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Extra random latency in seconds")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--csrf-rotate-every', type=float, default=None, help="Seconds between CSRF token rotations")
+    return parser
+
+def fake_from_args(args):
+    return FakeRoblox(
+        group_id=args.group_id,
+        user_count=args.users,
+        role_count=args.roles,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        csrf_rotate_every=args.csrf_rotate_every
+    )
+
+async def serve(args):
+    fake = fake_from_args(args)
+    base_url = await fake.start(args.host, args.port)
+    logger.info(f"Fake Roblox API listening on {base_url} (group {args.group_id})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(build_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
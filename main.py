@@ -5,10 +5,36 @@ import json
 import os
 import asyncio
 import aiohttp
+from aiohttp import web
 import datetime
 import logging
+import math
+import re
+import time
+import random
+import bisect
+import contextlib
+import contextvars
+import email.utils
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import mmap
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from collections import Counter, OrderedDict, deque
+from urllib.parse import urlsplit
 from typing import Optional, Union
 
+# Used to report how long the bot took to become ready
+PROCESS_STARTED = time.perf_counter()
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('roblox-ranking-bot')
@@ -24,31 +50,2401 @@ DEFAULT_CONFIG = {
         "suspension_permit": 123456789012345678  # Role ID for suspension permissions
     },
     "suspension_rank_name": "Customer",  # Default suspension rank name
-    "rank_bans": {},  # Will store: user_id: {"until": timestamp}
-    "suspensions": {}  # Will store: user_id: {"until": timestamp, "original_rank": rank_id}
+    "groups": {},  # More groups to manage, by name: {"staff": {"group_id": 123, "suspension_rank_name": "..."}}
+    "guild_groups": {},  # Group name commands use by default in each Discord server, keyed by server ID
+    "metrics": {
+        "enabled": True,  # Serve Prometheus metrics over HTTP
+        "host": "127.0.0.1",
+        "port": 9108
+    },
+    "role_refresh_interval": 600,  # Seconds between checks for roles added or changed on Roblox
+    "state_db": "state.db",  # SQLite database holding rank bans and suspensions
+    "user_cache": {
+        "max_size": 5000,  # Maximum number of cached username/ID lookups
+        "ttl": 3600,  # Seconds a resolved user stays cached
+        "negative_ttl": 300  # Seconds a "user not found" result stays cached
+    },
+    "autocomplete": {
+        "max_names": 10000,  # Maximum number of usernames and IDs offered as suggestions
+        "ttl": 86400  # Seconds a name stays suggestable after it was last seen
+    },
+    "api_urls": {  # Base URL of each Roblox API, e.g. to point the bot at a local test server
+        "auth": "https://auth.roblox.com",
+        "users": "https://users.roblox.com",
+        "groups": "https://groups.roblox.com"
+    },
+    "http": {
+        "limit": 100,  # Maximum open connections to Roblox
+        "limit_per_host": 20,  # Maximum open connections to each Roblox API host
+        "keepalive_timeout": 60,  # Seconds an idle connection is kept for reuse
+        "dns_cache_ttl": 300,  # Seconds resolved Roblox hostnames are cached
+        "timeouts": {  # Seconds allowed per request type; null disables a timeout
+            "read": {"total": 15, "connect": 5, "sock_read": 10},
+            "mutate": {"total": 20, "connect": 5, "sock_read": 15},
+            "bulk": {"total": 60, "connect": 5, "sock_read": 30}
+        },
+        "trace": False  # Count new versus reused connections and DNS cache hits
+    },
+    "rate_limits": {
+        "buckets": {  # Requests per second and burst size for each Roblox API family
+            "auth": {"rate": 1, "burst": 3},
+            "users": {"rate": 5, "burst": 10},
+            "groups": {"rate": 5, "burst": 10}
+        },
+        "priority_weights": {  # Share of each bucket given to each request class while several are waiting
+            "interactive": 16,  # Slash commands and the rank changes they queue
+            "bulk": 4,  # /bulkrank
+            "background": 1  # Restores, refreshes and reconciliation
+        },
+        "max_retries": 4,  # Retries for 429 and 5xx responses
+        "backoff_base": 0.5,  # Seconds before the first retry, doubled on every attempt
+        "backoff_max": 30  # Longest wait between retries
+    },
+    "restores": {
+        "concurrency": 5,  # Number of suspension restores sent to Roblox at once
+        "retry_base": 30,  # Seconds before retrying a failed restore, doubled on every failure
+        "retry_max": 1800  # Longest wait between restore attempts
+    },
+    "roster_mirror": {
+        "enabled": False,  # Keep an in-memory copy of the group member list
+        "refresh_interval": 300,  # Seconds between refreshes of roles whose member count changed
+        "full_refresh_interval": 3600,  # Seconds between refreshes of every role
+        "max_age": 900  # Seconds after the last refresh that the mirror is still trusted
+    },
+    "reconciliation": {
+        "enabled": True,  # Periodically check that suspended users are still at the suspension rank
+        "interval": 900,  # Seconds between checks
+        "grace_period": 300  # Seconds a new suspension is left alone, while Roblox member listings catch up
+    },
+    "rank_jobs": {
+        "concurrency": 3,  # Number of queued rank changes sent to Roblox at once
+        "max_attempts": 5,  # Attempts before a queued rank change is given up on
+        "retry_base": 5,  # Seconds before retrying a failed rank change, doubled on every failure
+        "retry_max": 300  # Longest wait between attempts
+    },
+    "bulk_rank": {
+        "max_users": 200,  # Maximum number of users accepted by /bulkrank
+        "concurrency": 5  # Number of rank changes sent to Roblox at once
+    },
+    "audit_log": {
+        "directory": "audit",  # Directory holding the audit log segments and indexes
+        "segment_size": 67108864,  # Bytes after which the audit log starts a new segment file
+        "page_size": 10  # Records shown per page of /history
+    },
+    "cluster": {
+        "enabled": False,  # Run as one of several workers sharing state_db; only the elected leader runs sweeps
+        "worker_id": None,  # Unique name of this worker, defaults to the host name and process ID
+        "shard_ids": None,  # Discord shards run by this worker, e.g. [0, 1]; null runs every shard
+        "shard_count": None,  # Total Discord shards over all workers; null lets Discord decide
+        "lease_ttl": 30,  # Seconds the leader lease lasts without being renewed
+        "renew_interval": 10,  # Seconds between lease renewals and takeover attempts
+        "poll_interval": 5  # Seconds between the leader's checks for work added by other workers
+    },
+    "diagnostics": {
+        "enabled": False,  # Measure event loop lag and log slow callbacks all the time
+        "lag_interval": 0.5,  # Seconds between event loop lag probes
+        "slow_callback": 0.1,  # Seconds a callback may block the event loop before it is logged
+        "profile_interval": 0.005,  # Seconds between stack samples while profiling
+        "max_profile_seconds": 60  # Longest profile /diagnostics will take
+    },
+    "config_reload": {
+        "watch": True,  # Reload config.json when it changes on disk
+        "interval": 5  # Seconds between checks for changes
+    }
 }
 
-# Ensure config file exists or create it
+CONFIG_PATH = os.getenv('CONFIG_PATH', 'config.json')
+
 def load_config():
-    if not os.path.exists('config.json'):
-        with open('config.json', 'w') as f:
-            json.dump(DEFAULT_CONFIG, f, indent=4)
-        print("Config file created! Please fill in your details in config.json before running the bot again.")
-        exit(0)
-    
-    with open('config.json', 'r') as f:
+    with open(CONFIG_PATH, 'r') as f:
         return json.load(f)
 
+# Ensure config file exists or create it; main() asks for it to be filled in before starting
+CONFIG_CREATED = not os.path.exists(CONFIG_PATH)
+if CONFIG_CREATED:
+    with open(CONFIG_PATH, 'w') as f:
+        json.dump(DEFAULT_CONFIG, f, indent=4)
+
 CONFIG = load_config()
 
+def config_section(name):
+    """Get a config section with defaults filled in for keys missing from config.json"""
+    return {**DEFAULT_CONFIG.get(name, {}), **CONFIG.get(name, {})}
+
+# Name of the group configured by the top-level group_id
+MAIN_GROUP = "main"
+
+def group_configs():
+    """Every group the bot manages as {name: {"group_id", "suspension_rank_name"}}"""
+    suspension_rank_name = CONFIG.get('suspension_rank_name', DEFAULT_CONFIG['suspension_rank_name'])
+    groups = {MAIN_GROUP: {"group_id": CONFIG['group_id'], "suspension_rank_name": suspension_rank_name}}
+    for name, group in CONFIG.get('groups', {}).items():
+        groups[name] = {"suspension_rank_name": suspension_rank_name, **group}
+    return groups
+
+# Config sections RobloxRankingBot.reload_config puts into effect; the rest are read once at startup
+RELOADABLE_CONFIG = (
+    'cookie', 'group_id', 'groups', 'suspension_rank_name', 'guild_groups', 'roles',
+    'role_refresh_interval', 'rate_limits', 'bulk_rank', 'config_reload', 'diagnostics'
+)
+
+# Settings that must be whole numbers, and those that may be 0; every other number must be positive
+INTEGER_SETTINGS = ('max_users', 'concurrency', 'max_retries')
+ZERO_SETTINGS = ('max_retries',)
+
+def validate_settings(values, defaults, path=''):
+    """List the values of a config section whose type or range doesn't fit their defaults"""
+    problems = []
+    for key, default in defaults.items():
+        if key not in values:
+            continue
+        value = values[key]
+        name = f"{path}.{key}" if path else key
+        if isinstance(default, dict):
+            if not isinstance(value, dict):
+                problems.append(f"{name} must be an object")
+            else:
+                problems.extend(validate_settings(value, default, name))
+        elif isinstance(default, bool):
+            if not isinstance(value, bool):
+                problems.append(f"{name} must be true or false")
+        elif isinstance(default, (int, float)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                problems.append(f"{name} must be a number")
+            elif key in INTEGER_SETTINGS and not isinstance(value, int):
+                problems.append(f"{name} must be a whole number")
+            elif value < 0 or (value == 0 and key not in ZERO_SETTINGS):
+                problems.append(f"{name} must be {'at least 0' if key in ZERO_SETTINGS else 'greater than 0'}")
+    return problems
+
+def validate_config(config):
+    """List the problems that stop a config from being used, empty if there are none"""
+    if not isinstance(config, dict):
+        return ["the config must be a JSON object"]
+    problems = []
+    if not isinstance(config.get('cookie'), str) or not config['cookie']:
+        problems.append("cookie must be set")
+    if not isinstance(config.get('group_id'), int):
+        problems.append("group_id must be a number")
+    for name, default in DEFAULT_CONFIG.items():
+        if isinstance(default, dict) and not isinstance(config.get(name, {}), dict):
+            problems.append(f"{name} must be an object")
+    if problems:
+        return problems
+    
+    roles = config.get('roles', {})
+    for permission, role_id in roles.items():
+        if role_id is not None and not str(role_id).isdigit():
+            problems.append(f"roles.{permission} must be a Discord role ID")
+    group_ids = {config['group_id']}
+    for name, group in config.get('groups', {}).items():
+        if name == MAIN_GROUP:
+            problems.append(f"groups can't use the name '{MAIN_GROUP}', which is the top-level group_id")
+        elif not isinstance(group, dict) or not isinstance(group.get('group_id'), int):
+            problems.append(f"groups.{name}.group_id must be a number")
+        elif group['group_id'] in group_ids:
+            problems.append(f"group {group['group_id']} is configured twice")
+        else:
+            group_ids.add(group['group_id'])
+    group_names = {MAIN_GROUP, *config.get('groups', {})}
+    for guild_id, name in config.get('guild_groups', {}).items():
+        if name not in group_names:
+            problems.append(f"guild_groups.{guild_id} names an unknown group '{name}'")
+    if not isinstance(config.get('suspension_rank_name', ''), str):
+        problems.append("suspension_rank_name must be a role name")
+    # Reloaded settings replace live ones, so they must be usable as they are
+    settings = ('role_refresh_interval', 'rate_limits', 'bulk_rank', 'config_reload', 'diagnostics')
+    problems.extend(validate_settings(config, {name: DEFAULT_CONFIG[name] for name in settings}))
+    return problems
+
 # Save configuration changes
 def save_config():
-    with open('config.json', 'w') as f:
+    # Write to a temporary file first so a crash can't leave a half-written config
+    with open(f'{CONFIG_PATH}.tmp', 'w') as f:
         json.dump(CONFIG, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{CONFIG_PATH}.tmp', CONFIG_PATH)
+
+# Persistent storage for rank bans and suspensions
+class StateStore:
+    """SQLite store for rank bans, suspensions and queued rank changes
+    
+    Rows are keyed by (group_id, user_id) so every Roblox group has its own namespace. Every
+    write touches a single row, and all database work runs in a worker thread so the event
+    loop is never blocked on disk I/O.
+    """
+    
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS rank_bans (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            until REAL NOT NULL,
+            PRIMARY KEY (group_id, user_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS rank_bans_until ON rank_bans (until)",
+        """CREATE TABLE IF NOT EXISTS suspensions (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            until REAL NOT NULL,
+            original_rank INTEGER NOT NULL,
+            created_at REAL,
+            drift TEXT,
+            PRIMARY KEY (group_id, user_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS suspensions_until ON suspensions (until)",
+        """CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS rank_jobs (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            context TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (group_id, user_id)
+        )"""
+    )
+    
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in self.SCHEMA:
+                    self._conn.execute(statement)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    
+    async def execute(self, sql, params=()):
+        """Run a statement in a worker thread and return all result rows"""
+        return await self._run(self._execute, sql, params)
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    # Rank bans
+    async def add_rank_ban(self, group_id, user_id, until):
+        await self.execute(
+            "INSERT OR REPLACE INTO rank_bans (group_id, user_id, until) VALUES (?, ?, ?)",
+            (group_id, int(user_id), until)
+        )
+    
+    async def get_rank_ban(self, group_id, user_id):
+        """Get an active rank ban as {"until": timestamp}, or None"""
+        rows = await self.execute(
+            "SELECT until FROM rank_bans WHERE group_id = ? AND user_id = ? AND until > ?",
+            (group_id, int(user_id), time.time())
+        )
+        return {"until": rows[0]['until']} if rows else None
+    
+    async def get_rank_bans(self, group_id, user_ids):
+        """Get the active rank bans for many users as {user_id: {"until": timestamp}}"""
+        user_ids = [int(user_id) for user_id in user_ids]
+        bans = {}
+        now = time.time()
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(user_ids), 500):
+            batch = user_ids[start:start + 500]
+            rows = await self.execute(
+                f"SELECT user_id, until FROM rank_bans WHERE group_id = ? AND until > ? "
+                f"AND user_id IN ({','.join('?' * len(batch))})",
+                (group_id, now, *batch)
+            )
+            bans.update({row['user_id']: {"until": row['until']} for row in rows})
+        return bans
+    
+    async def remove_rank_ban(self, group_id, user_id):
+        await self.execute("DELETE FROM rank_bans WHERE group_id = ? AND user_id = ?", (group_id, int(user_id)))
+    
+    def _pop_expired_rank_bans(self, now):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("SELECT group_id, user_id FROM rank_bans WHERE until <= ?", (now,)).fetchall()
+                self._conn.execute("DELETE FROM rank_bans WHERE until <= ?", (now,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(row['group_id'], row['user_id']) for row in rows]
+    
+    async def pop_expired_rank_bans(self, now):
+        """Delete every rank ban that has run out and return the affected (group_id, user_id) pairs"""
+        return await self._run(self._pop_expired_rank_bans, now)
+    
+    # Suspensions
+    async def add_suspension(self, group_id, user_id, until, original_rank):
+        await self.execute(
+            "INSERT OR REPLACE INTO suspensions (group_id, user_id, until, original_rank, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (group_id, int(user_id), until, int(original_rank), time.time())
+        )
+    
+    async def get_suspension(self, group_id, user_id):
+        """Get a suspension as {"until": timestamp, "original_rank": rank_id, "drift": reason or None}, or None"""
+        rows = await self.execute(
+            "SELECT until, original_rank, drift FROM suspensions WHERE group_id = ? AND user_id = ?",
+            (group_id, int(user_id))
+        )
+        return dict(rows[0]) if rows else None
+    
+    async def suspensions_by_group(self):
+        """Get every stored suspension as {group_id: [{"user_id", "until", "created_at", "drift"}]}"""
+        rows = await self.execute("SELECT group_id, user_id, until, created_at, drift FROM suspensions")
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['group_id'], []).append(dict(row))
+        return groups
+    
+    async def set_suspension_drift(self, group_id, user_id, until, drift):
+        """Mark (or with drift=None, unmark) a suspension as no longer matching Roblox, unless it was replaced"""
+        await self.execute(
+            "UPDATE suspensions SET drift = ? WHERE group_id = ? AND user_id = ? AND until = ?",
+            (drift, group_id, int(user_id), until)
+        )
+    
+    async def remove_suspension(self, group_id, user_id, until=None):
+        """Delete a suspension; if until is given, only delete it if it hasn't been replaced since"""
+        if until is None:
+            await self.execute(
+                "DELETE FROM suspensions WHERE group_id = ? AND user_id = ?",
+                (group_id, int(user_id))
+            )
+        else:
+            await self.execute(
+                "DELETE FROM suspensions WHERE group_id = ? AND user_id = ? AND until = ?",
+                (group_id, int(user_id), until)
+            )
+    
+    async def expired_suspensions(self, now):
+        """Get every suspension that has run out as [{"group_id", "user_id", "until", "original_rank"}]"""
+        rows = await self.execute(
+            "SELECT group_id, user_id, until, original_rank FROM suspensions WHERE until <= ?",
+            (now,)
+        )
+        return [dict(row) for row in rows]
+    
+    async def all_rank_bans(self):
+        """Get (group_id, user_id, until) for every stored rank ban"""
+        rows = await self.execute("SELECT group_id, user_id, until FROM rank_bans")
+        return [(row['group_id'], row['user_id'], row['until']) for row in rows]
+    
+    async def all_suspensions(self):
+        """Get (group_id, user_id, until) for every stored suspension"""
+        rows = await self.execute("SELECT group_id, user_id, until FROM suspensions")
+        return [(row['group_id'], row['user_id'], row['until']) for row in rows]
+    
+    async def counts(self):
+        """Number of stored rank bans, suspensions and suspensions marked as drifted"""
+        rows = await self.execute(
+            "SELECT (SELECT COUNT(*) FROM rank_bans) AS rank_bans, (SELECT COUNT(*) FROM suspensions) AS suspensions, "
+            "(SELECT COUNT(*) FROM suspensions WHERE drift IS NOT NULL) AS drifted_suspensions"
+        )
+        return dict(rows[0])
+    
+    # Rank change jobs
+    def _upsert_rank_job(self, group_id, user_id, role_id, context):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT * FROM rank_jobs WHERE group_id = ? AND user_id = ?",
+                    (group_id, user_id)
+                ).fetchall()
+                previous = self._job_from_row(rows[0]) if rows else None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rank_jobs "
+                    "(group_id, user_id, role_id, version, attempts, context, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 0, ?, ?, ?)",
+                    (group_id, user_id, role_id, previous['version'] + 1 if previous else 1, json.dumps(context), now, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return previous
+    
+    @staticmethod
+    def _job_from_row(row):
+        job = dict(row)
+        job['context'] = json.loads(job['context']) if job['context'] else {}
+        return job
+    
+    async def upsert_rank_job(self, group_id, user_id, role_id, context=None):
+        """Set the pending rank change for a user, returning the job it replaced (if any)"""
+        return await self._run(self._upsert_rank_job, group_id, int(user_id), int(role_id), context or {})
+    
+    async def get_rank_job(self, group_id, user_id):
+        rows = await self.execute(
+            "SELECT * FROM rank_jobs WHERE group_id = ? AND user_id = ?",
+            (group_id, int(user_id))
+        )
+        return self._job_from_row(rows[0]) if rows else None
+    
+    async def complete_rank_job(self, group_id, user_id, version):
+        """Delete a finished job unless it was replaced by a newer one meanwhile; True if deleted"""
+        rows = await self.execute(
+            "DELETE FROM rank_jobs WHERE group_id = ? AND user_id = ? AND version = ? RETURNING user_id",
+            (group_id, int(user_id), version)
+        )
+        return bool(rows)
+    
+    async def record_rank_job_failure(self, group_id, user_id, version):
+        await self.execute(
+            "UPDATE rank_jobs SET attempts = attempts + 1, updated_at = ? "
+            "WHERE group_id = ? AND user_id = ? AND version = ?",
+            (time.time(), group_id, int(user_id), version)
+        )
+    
+    async def pending_rank_jobs(self):
+        """Get (group_id, user_id) for every queued rank change, oldest first"""
+        rows = await self.execute("SELECT group_id, user_id FROM rank_jobs ORDER BY created_at")
+        return [(row['group_id'], row['user_id']) for row in rows]
+    
+    # Metadata
+    async def get_meta(self, key, default=None):
+        rows = await self.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0]['value']) if rows else default
+    
+    async def set_meta(self, key, value):
+        await self.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value))
+        )
+    
+    # Leases
+    async def try_acquire_lease(self, name, holder, ttl):
+        """Take or renew a lease unless another holder's lease is still running; True if held"""
+        now = time.time()
+        rows = await self.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at <= ? "
+            "RETURNING holder",
+            (name, holder, now + ttl, now)
+        )
+        return bool(rows)
+    
+    async def release_lease(self, name, holder):
+        await self.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+    
+    async def get_lease(self, name):
+        """Get a lease as {"holder", "expires_at"}, or None"""
+        rows = await self.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,))
+        return dict(rows[0]) if rows else None
+    
+    def _import_config_state(self, group_id, rank_bans, suspensions):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO rank_bans (group_id, user_id, until) VALUES (?, ?, ?)",
+                    [(group_id, int(user_id), info['until']) for user_id, info in rank_bans.items()]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO suspensions (group_id, user_id, until, original_rank) VALUES (?, ?, ?, ?)",
+                    [
+                        (group_id, int(user_id), info['until'], int(info['original_rank']))
+                        for user_id, info in suspensions.items()
+                    ]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('config_migrated', 'true')"
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    async def migrate_from_config(self, config):
+        """Move rank bans and suspensions still kept in config.json into the database"""
+        if 'rank_bans' not in config and 'suspensions' not in config:
+            return
+        rank_bans = config.get('rank_bans', {})
+        suspensions = config.get('suspensions', {})
+        # config.json only ever held state for the single group it configured
+        await self._run(self._import_config_state, int(config['group_id']), rank_bans, suspensions)
+        logger.info(f"Migrated {len(rank_bans)} rank bans and {len(suspensions)} suspensions from config.json")
+        
+        # Only drop them from config.json once the import has committed
+        config.pop('rank_bans', None)
+        config.pop('suspensions', None)
+        await self._run(save_config)
+
+# Append-only audit log of every change the bot makes
+class AuditIndex:
+    """Append-only file of fixed-size index entries, memory-mapped for reading
+    
+    Every entry links back to the previous entry with the same key, so all entries for one
+    key are found by following the chain from the newest one (kept in heads) without
+    touching entries for other keys.
+    """
+    
+    ENTRY = struct.Struct('<QIIq')  # key, segment, offset, previous entry with the same key (-1 if none)
+    
+    def __init__(self, path, readonly=False):
+        self.path = path
+        # A read-only index belongs to another process's log and is read with pread, since
+        # a mapping would fault if that process truncated the file while recovering
+        self.readonly = readonly
+        self._file = open(path, 'rb' if readonly else 'a+b')
+        if not readonly:
+            # Drop a partially written last entry left by a crash
+            size = os.fstat(self._file.fileno()).st_size
+            if size % self.ENTRY.size:
+                self._file.truncate(size - size % self.ENTRY.size)
+        self.count = 0
+        self._map = None
+        self._mapped = 0  # Entries covered by the current mapping
+        self.heads = {}  # key -> newest entry number
+        self.refresh()
+    
+    def refresh(self):
+        """Pick up entries appended since the file was last read, e.g. by the process writing it"""
+        count = os.fstat(self._file.fileno()).st_size // self.ENTRY.size
+        if count < self.count:
+            # The writer dropped entries while recovering from a crash, so start over
+            self.count = 0
+            self.heads.clear()
+        if count == self.count:
+            return
+        start = self.count
+        if self.readonly:
+            data = os.pread(self._file.fileno(), (count - start) * self.ENTRY.size, start * self.ENTRY.size)
+            data = data[:len(data) - len(data) % self.ENTRY.size]
+            self.count = start + len(data) // self.ENTRY.size
+            entries = self.ENTRY.iter_unpack(data)
+        else:
+            self.count = count
+            self._remap()
+            entries = itertools.islice(self.ENTRY.iter_unpack(self._map), start, None)
+        for number, (key, _, _, _) in enumerate(entries, start):
+            self.heads[key] = number
+    
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped = self.count
+    
+    def entry(self, number):
+        """Get (key, segment, offset, previous) for an entry"""
+        if self.readonly:
+            data = os.pread(self._file.fileno(), self.ENTRY.size, number * self.ENTRY.size)
+            if len(data) < self.ENTRY.size:
+                raise Exception(f"Audit index {self.path} lost entry {number}")
+            return self.ENTRY.unpack(data)
+        if number >= self._mapped:
+            # The file grew since it was mapped
+            self._remap()
+        return self.ENTRY.unpack_from(self._map, number * self.ENTRY.size)
+    
+    def truncate(self, count):
+        """Drop every entry from entry number count on, pointing heads back at the older entries"""
+        for number in range(self.count - 1, count - 1, -1):
+            key, _, _, previous = self.entry(number)
+            if previous >= 0:
+                self.heads[key] = previous
+            else:
+                del self.heads[key]
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapped = 0
+        self._file.truncate(count * self.ENTRY.size)
+        self.count = count
+    
+    def append(self, key, segment, offset):
+        previous = self.heads.get(key, -1)
+        self._file.write(self.ENTRY.pack(key, segment, offset, previous))
+        self._file.flush()
+        number = self.count
+        self.count += 1
+        self.heads[key] = number
+        return number
+    
+    def chain(self, key, before=None, limit=10):
+        """Entry numbers for a key, newest first, starting below the entry number before"""
+        number = self.heads.get(key, -1) if before is None else self.entry(before)[3]
+        while number >= 0 and limit > 0:
+            yield number
+            limit -= 1
+            number = self.entry(number)[3]
+    
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+class AuditLog:
+    """Append-only log of rank changes, rank bans, suspensions and shouts
+    
+    Records are zlib-compressed JSON, each framed with its length and CRC and appended to
+    numbered segment files. Three AuditIndex files point into the segments: every record,
+    records by Roblox user ID and records by Discord moderator ID. A page of history for one
+    user or moderator costs one read per record shown, however long the log gets.
+    """
+    
+    FRAME = struct.Struct('<II')  # compressed length, CRC32 of the compressed bytes
+    # Strings most records share, used as a preset zlib dictionary so short records still
+    # compress well. Changing it makes existing segments unreadable.
+    DICTIONARY = (
+        b'{"ts": , "action": "rank", "rank_ban", "rank_ban_expired", "suspend", "restore", "shout", '
+        b'"group_id": , "user_id": , "username": , "moderator_id": , "moderator": null, '
+        b'"from_role": , "to_role": , "until": , "message": , "bulk": true}'
+    )
+    
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, readonly=False):
+        """readonly opens a log another process writes to, for queries only"""
+        self.directory = directory
+        self.segment_size = segment_size
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.indexes = {
+            name: AuditIndex(os.path.join(directory, f'{name}.idx'), readonly=readonly)
+            for name in ('all', 'user', 'moderator')
+        }
+        self._readers = {}  # segment number -> file descriptor
+        segments = sorted(
+            int(name[8:-4]) for name in os.listdir(directory)
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+        self.segment = segments[-1] if segments else 1
+        self._writer = None
+        if not readonly:
+            try:
+                self._recover(segments)
+            except Exception as e:
+                # A broken audit log must never stop the bot from starting
+                logger.error(f"Failed to recover the audit log in {directory}: {e}")
+            self._writer = open(self._segment_path(self.segment), 'ab')
+    
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'segment-{segment:08d}.log')
+    
+    def _recover(self, segments):
+        """Make the indexes and segments agree again after a crash
+        
+        Nothing is fsynced, so after a power loss the newest indexed records may be torn and
+        each index may have lost a different number of entries. Index entries from the first
+        damaged record on are dropped, records written after an index's last entry are added
+        to it, and a torn record at the end of a segment is cut off.
+        """
+        all_index = self.indexes['all']
+        segment, offset = (segments[0] if segments else 1), 0
+        for number in range(all_index.count - 1, -1, -1):
+            _, entry_segment, entry_offset, _ = all_index.entry(number)
+            try:
+                self._read(entry_segment, entry_offset)
+            except Exception:
+                continue
+            segment = entry_segment
+            offset = entry_offset + self.FRAME.size + self._read_frame(entry_segment, entry_offset)[0]
+            break
+        
+        # Entries at or past the end of the last good record are re-created by the scan below
+        for name, index in self.indexes.items():
+            count = index.count
+            while count and index.entry(count - 1)[1:3] >= (segment, offset):
+                count -= 1
+            if count < index.count:
+                logger.warning(f"Dropping {index.count - count} audit {name} index entries past a damaged record")
+                index.truncate(count)
+        
+        # Scan from the oldest last entry of any index; records up to an index's last entry are in it
+        indexed = {
+            name: index.entry(index.count - 1)[1:3] if index.count else (0, -1)
+            for name, index in self.indexes.items()
+        }
+        segment, offset = min(indexed.values())
+        if segment not in segments:
+            segment, offset = (segments[0] if segments else 1), 0
+        recovered = 0
+        for segment in [number for number in segments if number >= segment]:
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            while offset < size:
+                try:
+                    record = self._read(segment, offset)
+                except Exception:
+                    logger.warning(f"Truncating audit segment {segment} at a damaged record (offset {offset})")
+                    os.truncate(path, offset)
+                    break
+                missing = [(name, key) for name, key in self._keys(record) if (segment, offset) > indexed[name]]
+                for name, key in missing:
+                    self.indexes[name].append(key, segment, offset)
+                offset += self.FRAME.size + self._read_frame(segment, offset)[0]
+                recovered += bool(missing)
+            offset = 0
+        if recovered:
+            logger.info(f"Indexed {recovered} audit records missing from the index")
+    
+    def _reader(self, segment):
+        if segment not in self._readers:
+            self._readers[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return self._readers[segment]
+    
+    def _read_frame(self, segment, offset):
+        header = os.pread(self._reader(segment), self.FRAME.size, offset)
+        if len(header) < self.FRAME.size:
+            raise Exception(f"Truncated audit record in segment {segment} at offset {offset}")
+        return self.FRAME.unpack(header)
+    
+    def _read(self, segment, offset):
+        length, crc = self._read_frame(segment, offset)
+        data = os.pread(self._reader(segment), length, offset + self.FRAME.size)
+        if len(data) < length or zlib.crc32(data) != crc:
+            raise Exception(f"Damaged audit record in segment {segment} at offset {offset}")
+        decompressor = zlib.decompressobj(zdict=self.DICTIONARY)
+        return json.loads(decompressor.decompress(data) + decompressor.flush())
+    
+    @staticmethod
+    def _keys(record):
+        """(index name, key) of every index entry for a record, 'all' last"""
+        keys = (('user', record.get('user_id')), ('moderator', record.get('moderator_id')), ('all', 0))
+        return [(name, key) for name, key in keys if key is not None]
+    
+    def _index(self, record, segment, offset):
+        for name, key in self._keys(record):
+            self.indexes[name].append(key, segment, offset)
+    
+    def _append(self, records):
+        with self._lock:
+            for record in records:
+                compressor = zlib.compressobj(level=9, zdict=self.DICTIONARY)
+                data = compressor.compress(json.dumps(record, separators=(',', ':')).encode()) + compressor.flush()
+                offset = self._writer.tell()
+                if offset and offset + self.FRAME.size + len(data) > self.segment_size:
+                    self._writer.close()
+                    self.segment += 1
+                    self._writer = open(self._segment_path(self.segment), 'ab')
+                    offset = 0
+                self._writer.write(self.FRAME.pack(len(data), zlib.crc32(data)) + data)
+                # The record must be readable before the index points at it
+                self._writer.flush()
+                self._index(record, self.segment, offset)
+    
+    def _page(self, user_id, moderator_id, before, limit):
+        """Get ([(entry number, record)], cursor) for _query and AuditLogSet"""
+        with self._lock:
+            if self.readonly:
+                for index in self.indexes.values():
+                    index.refresh()
+            if user_id is not None:
+                index, key = self.indexes['user'], int(user_id)
+            elif moderator_id is not None:
+                index, key = self.indexes['moderator'], int(moderator_id)
+            else:
+                index, key = self.indexes['all'], 0
+            
+            records = []
+            cursor = None
+            # With both filters, follow the user's chain and skip other moderators' records
+            scan_limit = limit if user_id is None or moderator_id is None else index.count
+            for number in index.chain(key, before, scan_limit):
+                cursor = number
+                _, segment, offset, _ = index.entry(number)
+                try:
+                    record = self._read(segment, offset)
+                except Exception as e:
+                    logger.warning(f"Skipping audit record: {e}")
+                    continue
+                if moderator_id is not None and record.get('moderator_id') != int(moderator_id):
+                    continue
+                records.append((number, record))
+                if len(records) >= limit:
+                    break
+            
+            has_more = cursor is not None and index.entry(cursor)[3] >= 0
+            return records, cursor if has_more else None
+    
+    def _query(self, user_id, moderator_id, before, limit):
+        records, cursor = self._page(user_id, moderator_id, before, limit)
+        return [record for _, record in records], cursor
+    
+    @staticmethod
+    def make_record(action, group_id=None, user_id=None, username=None, moderator_id=None, moderator=None, **details):
+        """Build a record; moderator_id and moderator (a name) are None for changes the bot made itself"""
+        return {
+            'ts': time.time(),
+            'action': action,
+            'group_id': group_id,
+            'user_id': int(user_id) if user_id is not None else None,
+            'username': username,
+            'moderator_id': int(moderator_id) if moderator_id is not None else None,
+            'moderator': moderator,
+            **details
+        }
+    
+    async def record(self, action, **fields):
+        """Append one record built from make_record's arguments"""
+        await self.record_many([self.make_record(action, **fields)])
+    
+    async def record_many(self, records):
+        """Append records built with make_record in one go"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._append, records)
+        except Exception as e:
+            # A broken audit log must never stop moderation itself
+            logger.error(f"Failed to write {len(records)} audit records: {e}")
+    
+    async def query(self, user_id=None, moderator_id=None, before=None, limit=10):
+        """Get up to limit records, newest first, for a user and/or moderator (or everything)
+        
+        Returns (records, cursor); pass the cursor back as before to get the next page, it is
+        None once there are no older records.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._query, user_id, moderator_id, before, limit
+        )
+    
+    def stats(self):
+        return {
+            'records': self.indexes['all'].count,
+            'users': len(self.indexes['user'].heads),
+            'moderators': len(self.indexes['moderator'].heads),
+            'segment': self.segment
+        }
+    
+    def close(self):
+        with self._lock:
+            if self._writer:
+                self._writer.close()
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers.clear()
+            for index in self.indexes.values():
+                index.close()
+
+class AuditLogSet:
+    """Every cluster worker's audit log, read as one log for /history
+    
+    A log has a single writer, so each worker appends to its own AuditLog in a subdirectory
+    named after it. The other workers' logs are opened read-only as they appear and a page is
+    merged from a page of each by time; the cursor holds where every log left off.
+    """
+    
+    def __init__(self, log, directory):
+        self.log = log  # This worker's own log
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._peers = {}  # subdirectory name -> read-only AuditLog
+    
+    def _logs(self):
+        with self._lock:
+            logs = {os.path.basename(os.path.normpath(self.log.directory)): self.log}
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if name in logs or not os.path.isdir(path):
+                    continue
+                if name not in self._peers:
+                    try:
+                        self._peers[name] = AuditLog(path, readonly=True)
+                    except Exception as e:
+                        # Most likely a worker that hasn't created its log yet
+                        logger.debug(f"Can't open audit log {path} yet: {e}")
+                        continue
+                logs[name] = self._peers[name]
+            return logs
+    
+    def _query(self, user_id, moderator_id, before, limit):
+        pages = {}
+        for name, log in self._logs().items():
+            if before is not None and name not in before:
+                continue  # Already exhausted
+            try:
+                pages[name] = log._page(user_id, moderator_id, None if before is None else before[name], limit)
+            except Exception as e:
+                logger.warning(f"Skipping audit log {name}: {e}")
+        
+        candidates = [
+            (record['ts'], name, number, record)
+            for name, (records, _) in pages.items()
+            for number, record in records
+        ]
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        shown = candidates[:limit]
+        
+        cursor = {}
+        for name, (records, next_cursor) in pages.items():
+            numbers = [number for _, shown_name, number, _ in shown if shown_name == name]
+            if len(numbers) < len(records):
+                # Carry on below the oldest record shown, or where this log was if none were
+                cursor[name] = numbers[-1] if numbers else None if before is None else before[name]
+            elif next_cursor is not None:
+                cursor[name] = next_cursor
+        return [record for _, _, _, record in shown], cursor or None
+    
+    async def query(self, user_id=None, moderator_id=None, before=None, limit=10):
+        """Same as AuditLog.query, across every worker's log"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._query, user_id, moderator_id, before, limit
+        )
+    
+    def close(self):
+        with self._lock:
+            for log in self._peers.values():
+                log.close()
+            self._peers.clear()
+
+# Deadline scheduling for rank bans and suspensions
+class ExpiryScheduler:
+    """Min-heap of expiry deadlines that sleeps until the earliest one is due
+    
+    Scheduling an earlier deadline wakes the sleeper so it can re-arm. Deadlines that are
+    already in the past (e.g. after downtime) fire immediately. Replaced or cancelled
+    entries are skipped lazily when they reach the top of the heap.
+    """
+    
+    # Re-check the clock at least this often in case the wall clock jumps
+    MAX_SLEEP = 3600
+    # Seconds before due deadlines are handled again after the handler failed
+    RETRY_DELAY = 30
+    
+    def __init__(self, handler):
+        self._handler = handler  # Coroutine function called whenever a deadline is due
+        self._heap = []  # (until, kind, group_id, user_id)
+        self._deadlines = {}  # (kind, group_id, user_id) -> until for the live entry
+        self._wakeup = asyncio.Event()
+        self._task = None
+    
+    def __len__(self):
+        return len(self._deadlines)
+    
+    def schedule(self, kind, group_id, user_id, until):
+        key = (kind, group_id, int(user_id))
+        self._deadlines[key] = until
+        heapq.heappush(self._heap, (until, *key))
+        if self._heap[0][0] == until:
+            # The new deadline is the earliest one, so the sleeper must re-arm
+            self._wakeup.set()
+    
+    def cancel(self, kind, group_id, user_id):
+        self._deadlines.pop((kind, group_id, int(user_id)), None)
+    
+    def clear(self):
+        self._heap = []
+        self._deadlines.clear()
+    
+    def next_deadline(self):
+        """Earliest live deadline, discarding stale heap entries on the way"""
+        while self._heap:
+            until, *key = self._heap[0]
+            if self._deadlines.get(tuple(key)) == until:
+                return until
+            heapq.heappop(self._heap)
+        return None
+    
+    def _pop_due(self, now):
+        due = []
+        while True:
+            until = self.next_deadline()
+            if until is None or until > now:
+                return due
+            _, *key = heapq.heappop(self._heap)
+            del self._deadlines[tuple(key)]
+            due.append((*key, until))
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+    
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    async def _run(self):
+        detach_from_interaction()
+        while True:
+            self._wakeup.clear()
+            deadline = self.next_deadline()
+            delay = self.MAX_SLEEP if deadline is None else min(deadline - time.time(), self.MAX_SLEEP)
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            due = self._pop_due(time.time())
+            try:
+                await self._handler(due)
+            except Exception as e:
+                logger.error(f"Error processing expirations, retrying in {self.RETRY_DELAY}s: {e}")
+                # The deadlines were popped before the handler ran, so put them back unless
+                # they were rescheduled meanwhile
+                retry_at = time.time() + self.RETRY_DELAY
+                for kind, group_id, user_id, _ in due:
+                    if (kind, group_id, user_id) not in self._deadlines:
+                        self.schedule(kind, group_id, user_id, retry_at)
+
+# Worker pool restoring ranks after suspensions end
+class RestorePipeline:
+    """Restores suspended users to their original rank with a pool of workers
+    
+    Failed restores are retried per user with jittered exponential backoff and never block
+    other restores or the expiry scheduler. Suspensions the reconciler marked as drifted are
+    removed without touching the user's rank.
+    """
+    
+    def __init__(self, roblox_api, store, on_restored=None, on_skipped=None, rank_jobs=None, concurrency=5,
+                 retry_base=30, retry_max=1800):
+        self.roblox_api = roblox_api
+        self.store = store
+        self.rank_jobs = rank_jobs  # RankJobQueue whose pending change for a user a restore replaces
+        self.on_restored = on_restored  # Coroutine function called with each restored suspension
+        self.on_skipped = on_skipped  # Coroutine function called with each drifted suspension and its drift
+        self.concurrency = concurrency
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._queue = asyncio.Queue()
+        self._pending = set()  # (group_id, user_id) queued, being restored or waiting for a retry
+        self._retries = {}  # (group_id, user_id) -> TimerHandle for the next attempt
+        self._attempts = {}  # (group_id, user_id) -> failed attempts so far
+        self._restore_times = deque()  # Completion times of recent restores
+        self._workers = []
+        self.in_progress = 0
+        self.restored = 0
+        self.failures = 0
+        self.dropped = 0  # Restores abandoned because the suspension was lifted or replaced
+        self.skipped = 0  # Restores not sent because the user was no longer at the suspension rank
+    
+    @staticmethod
+    def _key(suspension):
+        return suspension['group_id'], suspension['user_id']
+    
+    def submit(self, suspension):
+        """Queue a suspension ({"group_id", "user_id", "until", "original_rank"}) to be restored"""
+        key = self._key(suspension)
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        self._queue.put_nowait(suspension)
+    
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(max(1, self.concurrency))]
+    
+    def stop(self):
+        """Stop the workers and forget queued restores; the next sweep finds them in the store again"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        self._pending.clear()
+        self._attempts.clear()
+        self._queue = asyncio.Queue()
+    
+    async def _worker(self):
+        detach_from_interaction()
+        while True:
+            suspension = await self._queue.get()
+            self.in_progress += 1
+            try:
+                await self._restore(suspension)
+            except Exception as e:
+                logger.error(f"Error restoring rank for user ID {suspension['user_id']}: {e}")
+                self._retry(suspension)
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+    
+    async def _restore(self, suspension):
+        group_id, user_id = key = self._key(suspension)
+        
+        # The suspension may have been lifted or extended while this restore was waiting
+        current = await self.store.get_suspension(group_id, user_id)
+        if not current or current['until'] != suspension['until']:
+            self._finish(key)
+            self.dropped += 1
+            return
+        
+        # Restoring would undo whatever moved the user off the suspension rank
+        if current['drift']:
+            await self.store.remove_suspension(group_id, user_id, suspension['until'])
+            self._finish(key)
+            self.skipped += 1
+            logger.info(
+                f"Suspension expired for user ID {user_id} in group {group_id}, "
+                f"not restoring: {current['drift']}"
+            )
+            if self.on_skipped:
+                await self.on_skipped(suspension, current['drift'])
+            return
+        
+        group = self.roblox_api.group_by_id(group_id)
+        if not group:
+            # Keep the stored suspension so it is restored once the group is configured again
+            logger.warning(f"Not restoring user ID {user_id}: group {group_id} is no longer configured")
+            self._finish(key)
+            self.dropped += 1
+            return
+        
+        if self.rank_jobs:
+            await self.rank_jobs.supersede(group_id, user_id, "the end of a suspension")
+        success = await group.set_rank(user_id, suspension['original_rank'])
+        if not success:
+            self._retry(suspension)
+            return
+        
+        await self.store.remove_suspension(group_id, user_id, suspension['until'])
+        self._finish(key)
+        self.restored += 1
+        self._restore_times.append(time.monotonic())
+        logger.info(
+            f"Suspension expired for user ID {user_id} in group {group_id}, "
+            f"restored to rank {suspension['original_rank']}"
+        )
+        if self.on_restored:
+            await self.on_restored(suspension)
+    
+    def _finish(self, key):
+        self._pending.discard(key)
+        self._attempts.pop(key, None)
+    
+    def _retry(self, suspension):
+        key = self._key(suspension)
+        attempts = self._attempts.get(key, 0) + 1
+        self._attempts[key] = attempts
+        self.failures += 1
+        
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        logger.error(f"Failed to restore rank for user ID {key[1]} (attempt {attempts}), retrying in {delay:.0f}s")
+        self._retries[key] = asyncio.get_running_loop().call_later(delay, self._requeue, suspension)
+    
+    def _requeue(self, suspension):
+        self._retries.pop(self._key(suspension), None)
+        self._queue.put_nowait(suspension)
+    
+    def stats(self):
+        # Throughput over the last minute
+        cutoff = time.monotonic() - 60
+        while self._restore_times and self._restore_times[0] < cutoff:
+            self._restore_times.popleft()
+        return {
+            'queued': self._queue.qsize(),
+            'in_progress': self.in_progress,
+            'waiting_retry': len(self._retries),
+            'restored': self.restored,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'skipped': self.skipped,
+            'per_minute': len(self._restore_times)
+        }
+
+# Check of stored suspensions against Roblox
+class SuspensionReconciler:
+    """Periodically compares stored suspensions with the members of each group's suspension role
+    
+    Suspended users who were re-ranked on Roblox or left the group are marked as drifted, so
+    the restore pipeline doesn't move them back to their original rank. One member listing of
+    the suspension role covers every suspension in a group, unless that role is so large that
+    asking for each suspended user's rank takes fewer requests.
+    """
+    
+    DRIFT = "no longer at the suspension rank"
+    
+    def __init__(self, roblox_api, store, interval=900, grace_period=300):
+        self.roblox_api = roblox_api
+        self.store = store
+        self.interval = interval
+        self.grace_period = grace_period
+        self.runs = 0
+        self.checked = 0  # Suspensions checked by the last run
+        self.drifted = 0  # Suspensions newly marked as drifted since startup
+        self.cleared = 0  # Drift marks removed since startup because the user was back at the suspension rank
+        self.requests = 0  # Roblox requests made since startup
+        self.last_run = None
+        self._task = None
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+    
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    async def _run(self):
+        detach_from_interaction()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Failed to reconcile suspensions: {e}")
+    
+    async def reconcile(self):
+        """Check every stored suspension once"""
+        # Suspensions are read before the member listings, so every one of them was applied on
+        # Roblox before the listings were requested
+        suspensions_by_group = await self.store.suspensions_by_group()
+        cutoff = time.time() - self.grace_period
+        checked = drifted = cleared = 0
+        for group_id, suspensions in suspensions_by_group.items():
+            group = self.roblox_api.group_by_id(group_id)
+            if not group:
+                continue
+            role = group.roles.get(group.suspension_rank_name)
+            if not role:
+                logger.warning(f"Not reconciling suspensions in group {group.name}: suspension rank not found")
+                continue
+            suspensions = [s for s in suspensions if (s['created_at'] or 0) <= cutoff]
+            if not suspensions:
+                continue
+            
+            at_rank, unchecked = await self._members_at_rank(group, role, suspensions)
+            suspensions = [s for s in suspensions if s['user_id'] not in unchecked]
+            for suspension in suspensions:
+                drift = None if suspension['user_id'] in at_rank else self.DRIFT
+                if drift == suspension['drift']:
+                    continue
+                # Only updates the row if the suspension wasn't replaced in the meantime
+                await self.store.set_suspension_drift(group_id, suspension['user_id'], suspension['until'], drift)
+                if drift:
+                    drifted += 1
+                    logger.info(f"Suspended user ID {suspension['user_id']} in group {group.name} is {drift}")
+                else:
+                    cleared += 1
+            checked += len(suspensions)
+        
+        self.runs += 1
+        self.checked = checked
+        self.drifted += drifted
+        self.cleared += cleared
+        self.last_run = time.time()
+        logger.info(f"Reconciled {checked} suspensions: {drifted} drifted, {cleared} back at the suspension rank")
+    
+    async def _members_at_rank(self, group, role, suspensions):
+        """Get (user IDs of the suspension role's members, or at least of the suspended ones among
+        them, user IDs whose rank couldn't be checked this run)"""
+        if group.roster and group.roster.is_fresh():
+            return group.roster.members_of(role['id']), set()
+        
+        pages = max(1, -(-role.get('memberCount', 0) // 100))
+        if pages <= len(suspensions):
+            members = set()
+            async for member in group.get_role_members(role['id']):
+                members.add(member['userId'])
+            self.requests += pages
+            return members, set()
+        
+        members = set()
+        unchecked = set()
+        for suspension in suspensions:
+            self.requests += 1
+            try:
+                rank = (await self.roblox_api.get_user_group_roles(suspension['user_id'])).get(group.group_id)
+            except Exception as e:
+                # A failed lookup says nothing about drift, so the next run checks again
+                logger.warning(f"Not reconciling suspended user ID {suspension['user_id']} this run: {e}")
+                unchecked.add(suspension['user_id'])
+                continue
+            if rank and rank.get('id') == role['id']:
+                members.add(suspension['user_id'])
+        return members, unchecked
+    
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'checked': self.checked,
+            'drifted': self.drifted,
+            'cleared': self.cleared,
+            'requests': self.requests,
+            'last_run': self.last_run
+        }
+
+# Durable queue of rank changes
+class RankJobQueue:
+    """Outbox of rank changes stored in SQLite and drained by a pool of workers
+    
+    There is at most one job per user and group: submitting a new target replaces the pending
+    one, so the latest request wins. Code that sets ranks directly calls supersede() first so
+    an older job can't land on top of its change. A user is only ever worked on by one worker
+    at a time, and jobs left over from a previous run are picked up again at startup.
+    """
+    
+    def __init__(self, roblox_api, store, on_complete=None, on_superseded=None, concurrency=3, max_attempts=5,
+                 retry_base=5, retry_max=300):
+        self.roblox_api = roblox_api
+        self.store = store
+        self.on_complete = on_complete  # Coroutine function called with (job, success)
+        self.on_superseded = on_superseded  # Coroutine function called with (job, reason) by supersede()
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._queue = asyncio.Queue()
+        self._queued = set()  # (group_id, user_id) waiting in the queue
+        self._active = set()  # (group_id, user_id) being worked on right now
+        self._retries = {}  # (group_id, user_id) -> TimerHandle for the next attempt
+        self._finished = {}  # (group_id, user_id) -> Event set when its active job finishes
+        self._workers = []
+        self.completed = 0
+        self.failed = 0
+        self.superseded = 0
+    
+    async def submit(self, group_id, user_id, role_id, context=None):
+        """Queue a rank change, returning the pending job it replaced (if any)"""
+        key = (group_id, int(user_id))
+        previous = await self.store.upsert_rank_job(group_id, user_id, role_id, context)
+        if previous:
+            self.superseded += 1
+        
+        retry = self._retries.pop(key, None)
+        if retry:
+            # The new target shouldn't wait out the old job's backoff
+            retry.cancel()
+        # Without workers the job waits in the store for the worker that runs the queue
+        if self._workers:
+            self._enqueue(key)
+        return previous
+    
+    async def supersede(self, group_id, user_id, reason):
+        """Drop the pending job for a user whose rank is about to be set directly, returning it (if any)
+        
+        A job this worker is sending right now is waited for first, so it can't land after the
+        caller's change. reason describes the direct change and is passed to on_superseded.
+        """
+        key = (group_id, int(user_id))
+        while key in self._active:
+            await self._finished.setdefault(key, asyncio.Event()).wait()
+        job = await self.store.get_rank_job(group_id, user_id)
+        if not job:
+            return None
+        # A job queued in the meantime has a newer version and is left alone
+        if not await self.store.complete_rank_job(group_id, user_id, job['version']):
+            return None
+        retry = self._retries.pop(key, None)
+        if retry:
+            retry.cancel()
+        self.superseded += 1
+        if self.on_superseded:
+            try:
+                await self.on_superseded(job, reason)
+            except Exception as e:
+                logger.error(f"Failed to report replaced rank change for user ID {user_id}: {e}")
+        return job
+    
+    def _enqueue(self, key):
+        # A user being worked on is re-checked by that worker once it finishes
+        if key in self._queued or key in self._active:
+            return
+        self._queued.add(key)
+        self._queue.put_nowait(key)
+    
+    async def start(self):
+        """Start the workers and resume jobs left over from a previous run"""
+        if self._workers:
+            return
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(max(1, self.concurrency))]
+        resumed = await self.poll()
+        if resumed:
+            logger.info(f"Resuming {resumed} queued rank changes")
+    
+    async def poll(self):
+        """Queue stored jobs that aren't queued yet, such as those submitted by other workers"""
+        queued = 0
+        for key in await self.store.pending_rank_jobs():
+            if key in self._retries or key in self._queued or key in self._active:
+                continue
+            self._enqueue(key)
+            queued += 1
+        return queued
+    
+    def stop(self):
+        """Stop the workers; jobs stay in the store until the queue is started again"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        self._queued.clear()
+        self._active.clear()
+        for finished in self._finished.values():
+            finished.set()
+        self._finished.clear()
+        self._queue = asyncio.Queue()
+    
+    async def _worker(self):
+        # A moderator is waiting on every queued rank change, but not on a single interaction
+        detach_from_interaction('interactive')
+        while True:
+            key = await self._queue.get()
+            self._queued.discard(key)
+            self._active.add(key)
+            try:
+                rerun = await self._process(*key)
+            except Exception as e:
+                logger.error(f"Error processing rank change for user ID {key[1]} in group {key[0]}: {e}")
+                # The state store failed; back off instead of picking the job up again on the next poll
+                self._retries[key] = asyncio.get_running_loop().call_later(self.retry_base, self._retry, key)
+                rerun = False
+            finally:
+                self._active.discard(key)
+                finished = self._finished.pop(key, None)
+                if finished:
+                    finished.set()
+                self._queue.task_done()
+            if rerun:
+                self._enqueue(key)
+    
+    async def _process(self, group_id, user_id):
+        """Apply the pending job for a user; returns True if a newer job arrived meanwhile"""
+        job = await self.store.get_rank_job(group_id, user_id)
+        if not job:
+            return False
+        
+        group = self.roblox_api.group_by_id(group_id)
+        if group:
+            try:
+                success = await group.set_rank(user_id, job['role_id'])
+            except Exception as e:
+                # Connection errors that outlasted the request retries count as a failed attempt
+                logger.error(f"Error ranking user ID {user_id} in group {group_id}: {e}")
+                success = False
+        else:
+            logger.warning(f"Can't rank user ID {user_id}: group {group_id} is no longer configured")
+            success = False
+        if success:
+            finished = await self.store.complete_rank_job(group_id, user_id, job['version'])
+            self.completed += 1
+            await self._notify(job, True)
+            return not finished
+        
+        await self.store.record_rank_job_failure(group_id, user_id, job['version'])
+        attempts = job['attempts'] + 1
+        if attempts >= self.max_attempts:
+            finished = await self.store.complete_rank_job(group_id, user_id, job['version'])
+            self.failed += 1
+            logger.error(f"Giving up on ranking user ID {user_id} to role {job['role_id']} after {attempts} attempts")
+            await self._notify(job, False)
+            return not finished
+        
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        logger.warning(f"Failed to rank user ID {user_id} (attempt {attempts}), retrying in {delay:.0f}s")
+        key = (group_id, user_id)
+        self._retries[key] = asyncio.get_running_loop().call_later(delay, self._retry, key)
+        return False
+    
+    def _retry(self, key):
+        self._retries.pop(key, None)
+        self._enqueue(key)
+    
+    async def _notify(self, job, success):
+        if not self.on_complete:
+            return
+        try:
+            await self.on_complete(job, success)
+        except Exception as e:
+            logger.error(f"Failed to report rank change for user ID {job['user_id']}: {e}")
+    
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'in_progress': len(self._active),
+            'waiting_retry': len(self._retries),
+            'completed': self.completed,
+            'failed': self.failed,
+            'superseded': self.superseded
+        }
+
+# Leader election between workers sharing one state database
+class LeaderLease:
+    """Time-limited lease on a row in the state database, renewed in the background
+    
+    Only the holder runs singleton work such as expiry sweeps. A worker that stops renewing
+    (crash, hang or restart) loses the lease after ttl seconds and another worker takes over.
+    The work itself re-checks the store before acting, so a short overlap while an old leader
+    notices it lost the lease doesn't restore or rank anyone twice.
+    """
+    
+    def __init__(self, store, name, holder, ttl=30, renew_interval=10, on_acquired=None, on_lost=None):
+        self.store = store
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.on_acquired = on_acquired  # Coroutine function called when this worker becomes leader
+        self.on_lost = on_lost  # Coroutine function called when this worker stops being leader
+        self.valid_until = 0
+        self._leading = False
+        self._task = None
+    
+    @property
+    def held(self):
+        # Stop trusting the lease once it could have run out, even if renewals are just late
+        return self._leading and time.time() < self.valid_until
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """Stop renewing and hand the lease back so another worker can take over straight away"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._leading:
+            await self._set_leading(False)
+            try:
+                await self.store.release_lease(self.name, self.holder)
+            except Exception as e:
+                logger.error(f"Failed to release the {self.name} lease: {e}")
+    
+    async def _run(self):
+        detach_from_interaction()
+        while True:
+            started = time.time()
+            try:
+                acquired = await self.store.try_acquire_lease(self.name, self.holder, self.ttl)
+            except Exception as e:
+                logger.error(f"Failed to renew the {self.name} lease: {e}")
+                acquired = self.held
+            else:
+                if acquired:
+                    self.valid_until = started + self.ttl
+            await self._set_leading(acquired)
+            await asyncio.sleep(self.renew_interval)
+    
+    async def _set_leading(self, leading):
+        if leading == self._leading:
+            return
+        self._leading = leading
+        callback = self.on_acquired if leading else self.on_lost
+        logger.info(f"Worker {self.holder} {'acquired' if leading else 'lost'} the {self.name} lease")
+        if callback:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Error handling the {self.name} lease change: {e}")
+
+# Prefix index for user_identifier autocomplete
+class NameIndex:
+    """Bounded prefix index over usernames and user IDs the bot has already seen
+    
+    Keys are kept in a sorted list so a prefix search is a bisect plus a short scan. The
+    least recently seen names are evicted once the index is full.
+    """
+    
+    def __init__(self, max_size=10000, ttl=86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._keys = []  # Sorted lowercase search keys
+        self._entries = OrderedDict()  # key -> (label, value, last_seen), least recently seen first
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def add(self, key, label, value):
+        key = key.lower()
+        if key not in self._entries:
+            bisect.insort(self._keys, key)
+        self._entries[key] = (label, value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+    
+    def add_user(self, user_id, username=None):
+        """Index a user under both their username and their ID"""
+        if username:
+            self.add(username, username, username)
+            self.add(str(user_id), f"{user_id} ({username})", str(user_id))
+        elif str(user_id).lower() not in self._entries:
+            self.add(str(user_id), str(user_id), str(user_id))
+    
+    def _remove(self, key):
+        del self._entries[key]
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+    
+    def search(self, prefix, limit=25):
+        """Return up to limit (label, value) pairs whose key starts with prefix"""
+        prefix = prefix.lower().strip()
+        cutoff = time.monotonic() - self.ttl
+        results = []
+        stale = []
+        
+        if not prefix:
+            # Nothing typed yet, so suggest the most recently seen names
+            for key in reversed(self._entries):
+                label, value, last_seen = self._entries[key]
+                if last_seen < cutoff:
+                    break
+                results.append((label, value))
+                if len(results) >= limit:
+                    break
+            return results
+        
+        index = bisect.bisect_left(self._keys, prefix)
+        while index < len(self._keys) and len(results) < limit:
+            key = self._keys[index]
+            if not key.startswith(prefix):
+                break
+            label, value, last_seen = self._entries[key]
+            if last_seen < cutoff:
+                stale.append(key)
+            else:
+                results.append((label, value))
+            index += 1
+        
+        for key in stale:
+            self._remove(key)
+        return results
+
+# Cache for username <-> user ID lookups
+class UserCache:
+    """Bounded TTL/LRU cache for Roblox user lookups with in-flight request coalescing"""
+    
+    def __init__(self, max_size=5000, ttl=3600, negative_ttl=300, on_store=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.on_store = on_store  # Called with (user_id, username) for every resolved user
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> asyncio.Task
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+    
+    @staticmethod
+    def id_key(user_id):
+        return ('id', int(user_id))
+    
+    @staticmethod
+    def name_key(username):
+        return ('name', str(username).lower())
+    
+    def get(self, key):
+        """Return (found, value) for a cached key, dropping it if it has expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+    
+    def set(self, key, value):
+        """Cache a value; None is cached as a negative (not found) result"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def store_user(self, user_id, username):
+        """Cache a resolved user under both its ID and its username"""
+        value = (int(user_id), username)
+        self.set(self.id_key(user_id), value)
+        if username:
+            self.set(self.name_key(username), value)
+        if self.on_store:
+            self.on_store(int(user_id), username)
+    
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    async def lookup(self, key, fetch):
+        """Get a cached value, or run fetch() once for all concurrent callers of the same key
+        
+        fetch must return (user_id, username) or None when the user does not exist; exceptions
+        are passed through to every waiter and are not cached.
+        """
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+        
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+        
+        self.misses += 1
+        task = asyncio.ensure_future(self._fetch(key, fetch))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def _fetch(self, key, fetch):
+        value = await fetch()
+        if value is None:
+            self.set(key, None)
+        else:
+            self.store_user(*value)
+        return value
+    
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0
+        }
+
+# Metrics exposed in the Prometheus text format
+class Metrics:
+    """Minimal registry of counters, gauges and histograms served over HTTP
+    
+    Collectors registered with add_collector run on every scrape to refresh gauges whose
+    values are cheaper to read on demand than to keep up to date.
+    """
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}  # name -> {"type", "help", "buckets", "values"}
+        self._collectors = []
+        self._runner = None
+    
+    def describe(self, name, kind, help_text, buckets=None):
+        self._metrics[name] = {
+            'type': kind,
+            'help': help_text,
+            'buckets': tuple(buckets or self.DEFAULT_BUCKETS),
+            'values': {}  # sorted label tuple -> value, or [bucket counts, sum, count] for histograms
+        }
+    
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        values = self._metrics[name]['values']
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0) + amount
+    
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self._metrics[name]['values'][tuple(sorted(labels.items()))] = value
+    
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        metric = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        series = metric['values'].get(key)
+        if series is None:
+            series = metric['values'][key] = [[0] * len(metric['buckets']), 0.0, 0]
+        index = bisect.bisect_left(metric['buckets'], value)
+        if index < len(metric['buckets']):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+    
+    def add_collector(self, collector):
+        """Register a coroutine function that updates gauges before each scrape"""
+        self._collectors.append(collector)
+    
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+    
+    async def render(self):
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in metric['values'].items():
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+                    continue
+                bucket_counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(metric['buckets'], bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+    
+    async def _handle_metrics(self, request):
+        return web.Response(text=await self.render(), content_type='text/plain', charset='utf-8')
+    
+    async def start_server(self, host, port):
+        """Serve /metrics on the running event loop"""
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, host, port).start()
+        except OSError as e:
+            # e.g. the port is taken by another worker; the bot runs fine without the endpoint
+            logger.error(f"Not serving metrics, couldn't listen on {host}:{port}: {e}")
+            await self.stop_server()
+            return
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    
+    async def stop_server(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics = Metrics(enabled=config_section('metrics')['enabled'])
+metrics.describe('roblox_request_seconds', 'histogram', 'Latency of Roblox API requests by endpoint and status code')
+metrics.describe('roblox_request_errors_total', 'counter', 'Roblox API requests that failed without a response')
+metrics.describe('command_seconds', 'histogram', 'Time from a slash command being invoked to its handler finishing')
+metrics.describe('command_errors_total', 'counter', 'Slash commands that raised an error')
+metrics.describe('expiry_sweep_seconds', 'histogram', 'Duration of expiry sweeps')
+metrics.describe('active_rank_bans', 'gauge', 'Rank bans currently stored')
+metrics.describe('active_suspensions', 'gauge', 'Suspensions currently stored')
+metrics.describe('restore_queue_depth', 'gauge', 'Suspension restores waiting to run or to be retried')
+metrics.describe('restores_total', 'counter', 'Suspension restores completed since startup')
+metrics.describe('restore_failures_total', 'counter', 'Failed suspension restore attempts since startup')
+metrics.describe('drifted_suspensions', 'gauge', 'Stored suspensions whose user is no longer at the suspension rank')
+metrics.describe('restores_skipped_total', 'counter', 'Expired suspensions not restored because they had drifted')
+metrics.describe('rank_job_queue_depth', 'gauge', 'Queued rank changes waiting to run or to be retried')
+metrics.describe('rank_jobs_total', 'counter', 'Queued rank changes since startup by result')
+metrics.describe('cluster_leader', 'gauge', '1 if this worker runs expiry sweeps, restores and queued rank changes')
+metrics.describe('user_cache_lookups_total', 'counter', 'User cache lookups since startup by result')
+metrics.describe('roblox_connections_total', 'counter', 'Connections to Roblox opened or reused (only counted when http.trace is on)')
+metrics.describe('event_loop_lag_seconds', 'histogram', 'How late the event loop ran a probe scheduled by /diagnostics monitoring')
+metrics.describe('slow_callbacks_total', 'counter', 'Callbacks that blocked the event loop longer than diagnostics.slow_callback')
+metrics.describe('rate_limit_tokens', 'gauge', 'Tokens available in each Roblox rate limit bucket')
+metrics.describe('rate_limit_waiting', 'gauge', 'Requests waiting for a rate limit token by family and priority')
+metrics.describe('roblox_requests_dropped_total', 'counter', 'Requests dropped because their Discord interaction expired')
+
+NUMERIC_PATH_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+def endpoint_label(method, url):
+    """Describe a request by method and path with numeric IDs removed, e.g. 'PATCH /v1/groups/{id}/users/{id}'"""
+    path = NUMERIC_PATH_SEGMENT.sub('/{id}', urlsplit(url).path)
+    return f"{method} {path}"
+
+# Event loop health checks and sampling profiler
+class LoopMonitor:
+    """Measures event loop lag, records slow callbacks and takes sampling profiles
+    
+    While monitoring, the loop runs in asyncio debug mode so every callback that blocks it
+    for slow_callback seconds or more is logged, and a probe measures how late the loop
+    wakes it up. Nothing runs while monitoring is off. Profiles can be taken either way.
+    """
+    
+    # Frames the event loop thread sits in while waiting for I/O
+    IDLE_FRAMES = ('select', 'poll', 'epoll', 'kqueue', 'control')
+    
+    def __init__(self, lag_interval=0.5, slow_callback=0.1, profile_interval=0.005):
+        self.lag_interval = lag_interval
+        self.slow_callback = slow_callback
+        self.profile_interval = profile_interval
+        self.lag_samples = deque(maxlen=600)  # Recent lag measurements in seconds
+        self.max_lag = 0.0
+        self.slow_callbacks = deque(maxlen=10)  # (timestamp, description) of the latest slow callbacks
+        self.slow_callback_count = 0
+        self._loop = None
+        self._task = None
+    
+    @property
+    def enabled(self):
+        return self._task is not None
+    
+    def configure(self, lag_interval, slow_callback, profile_interval):
+        self.lag_interval = lag_interval
+        self.slow_callback = slow_callback
+        self.profile_interval = profile_interval
+        if self.enabled:
+            self._loop.slow_callback_duration = slow_callback
+    
+    def start(self):
+        if self._task:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop.slow_callback_duration = self.slow_callback
+        self._loop.set_debug(True)
+        logging.getLogger('asyncio').addFilter(self._on_asyncio_record)
+        self._task = asyncio.ensure_future(self._probe())
+    
+    def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        self._task = None
+        self._loop.set_debug(False)
+        logging.getLogger('asyncio').removeFilter(self._on_asyncio_record)
+    
+    async def _probe(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.monotonic() - started - self.lag_interval)
+            self.lag_samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe('event_loop_lag_seconds', lag)
+    
+    def _on_asyncio_record(self, record):
+        # asyncio logs 'Executing <handle> took N seconds' for slow callbacks in debug mode
+        if isinstance(record.msg, str) and record.msg.startswith('Executing ') and len(record.args) == 2:
+            self.slow_callback_count += 1
+            self.slow_callbacks.append((time.time(), f"{record.args[0]} took {record.args[1]:.3f}s"))
+            metrics.inc('slow_callbacks_total')
+        return True
+    
+    async def profile(self, seconds):
+        """Sample the event loop thread's stack for the given time, returning {folded stack: samples}
+        
+        Stacks are folded root first with frames joined by ';', the input format of
+        flamegraph.pl and speedscope. Sampling runs in a worker thread.
+        """
+        thread_id = threading.get_ident()
+        return await asyncio.get_running_loop().run_in_executor(None, self._sample, thread_id, seconds)
+    
+    def _sample(self, thread_id, seconds):
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                stacks[';'.join(reversed(names))] += 1
+            time.sleep(self.profile_interval)
+        return stacks
+    
+    def summarize_profile(self, stacks, top=10):
+        """Sample count, share of samples not spent waiting for I/O, and the busiest functions"""
+        samples = sum(stacks.values())
+        own = Counter()
+        for stack, count in stacks.items():
+            leaf = stack.rsplit(';', 1)[-1]
+            if leaf.split(' ', 1)[0] not in self.IDLE_FRAMES:
+                own[leaf] += count
+        busy = sum(own.values())
+        return {
+            'samples': samples,
+            'busy': busy / samples if samples else 0.0,
+            'top': own.most_common(top)
+        }
+    
+    def stats(self):
+        ordered = sorted(self.lag_samples)
+        return {
+            'enabled': self.enabled,
+            'lag_last': self.lag_samples[-1] if self.lag_samples else None,
+            'lag_p50': ordered[len(ordered) // 2] if ordered else None,
+            'lag_p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else None,
+            'lag_max': self.max_lag,
+            'slow_callbacks': self.slow_callback_count,
+            'recent_slow_callbacks': list(self.slow_callbacks)
+        }
+
+# Priority of the Roblox requests made by the current task: 'interactive', 'bulk' or 'background'
+request_priority = contextvars.ContextVar('request_priority', default='background')
+# Discord interaction the current task is answering; its requests are dropped once it can't be answered
+request_interaction = contextvars.ContextVar('request_interaction', default=None)
+
+# Discord allows 3 seconds for the first response and keeps the token valid for 15 minutes
+INTERACTION_RESPONSE_WINDOW = 3
+INTERACTION_TOKEN_LIFETIME = 900
+
+def interaction_time_left(interaction):
+    """Seconds until an interaction can no longer be answered, or None without an interaction"""
+    if interaction is None:
+        return None
+    window = INTERACTION_TOKEN_LIFETIME if interaction.response.is_done() else INTERACTION_RESPONSE_WINDOW
+    return window - (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+def detach_from_interaction(priority='background'):
+    """Give the current task its own request priority, independent of any interaction it was started from
+    
+    Tasks copy the context they are created in, so a long-lived task started by a command
+    would otherwise send every request at interactive priority and have them dropped once
+    that interaction expires.
+    """
+    request_priority.set(priority)
+    request_interaction.set(None)
+
+def start_detached(start, *args):
+    """Call a function that creates background tasks in an empty context, so they don't copy the caller's"""
+    return contextvars.Context().run(start, *args)
+
+# Rate limiting for Roblox API requests
+class TokenBucket:
+    """Token bucket pacing requests to one family of Roblox endpoints
+    
+    Waiting requests are queued by priority class and tokens are shared between the classes
+    by weighted fair queuing: with weights 16/4/1, interactive requests get 16 tokens for
+    every one a background request gets while both are waiting, and no class starves.
+    """
+    
+    def __init__(self, name, rate, burst, weights=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.weights = weights or DEFAULT_CONFIG['rate_limits']['priority_weights']
+        self.throttled = 0  # Requests that had to wait for a token
+        self.rate_limited = 0  # 429 responses received
+        self.granted = {priority: 0 for priority in self.weights}
+        self.expired = {priority: 0 for priority in self.weights}  # Requests whose deadline passed while queued
+        self._waiters = {priority: deque() for priority in self.weights}  # priority -> futures in arrival order
+        self._passes = {priority: 0.0 for priority in self.weights}  # Virtual time of each class
+        self._virtual_time = 0.0
+        self._dispatcher = None
+    
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def acquire(self, priority='background', timeout=None):
+        """Wait until a request may be sent; returns False if timeout seconds pass first"""
+        if priority not in self._waiters:
+            priority = 'background'
+        if timeout is not None and timeout <= 0:
+            self.expired[priority] += 1
+            return False
+        
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1 and self.blocked_until <= now and not any(self._waiters.values()):
+            self.tokens -= 1
+            self.granted[priority] += 1
+            return True
+        
+        future = asyncio.get_running_loop().create_future()
+        if not self._waiters[priority]:
+            # A class that was idle doesn't get to spend the turns it skipped
+            self._passes[priority] = max(self._passes[priority], self._virtual_time)
+        self._waiters[priority].append(future)
+        self.throttled += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.expired[priority] += 1
+            return False
+        return True
+    
+    async def _dispatch(self):
+        """Hand out tokens to waiting requests as they refill"""
+        while True:
+            for waiters in self._waiters.values():
+                while waiters and waiters[0].done():
+                    waiters.popleft()
+            active = [priority for priority, waiters in self._waiters.items() if waiters]
+            if not active:
+                return
+            
+            now = time.monotonic()
+            self._refill(now)
+            delay = self.blocked_until - now
+            if delay <= 0:
+                if self.tokens >= 1:
+                    # The class furthest behind its share goes next
+                    priority = min(active, key=lambda priority: self._passes[priority])
+                    self._virtual_time = self._passes[priority]
+                    self._passes[priority] += 1 / self.weights[priority]
+                    self.tokens -= 1
+                    self.granted[priority] += 1
+                    self._waiters[priority].popleft().set_result(None)
+                    continue
+                delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+    
+    def block_for(self, seconds):
+        """Stop handing out tokens for the given number of seconds"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+    
+    def update_from_headers(self, headers):
+        """Pause the bucket when Roblox reports the current rate limit window is used up"""
+        remaining = _parse_number(headers.get('x-ratelimit-remaining'))
+        reset = _parse_number(headers.get('x-ratelimit-reset'))
+        if remaining is not None and remaining <= 0 and reset:
+            self.block_for(reset)
+    
+    def state(self):
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            'tokens': self.tokens,
+            'rate': self.rate,
+            'burst': self.burst,
+            'blocked_for': max(0.0, self.blocked_until - now),
+            'throttled': self.throttled,
+            'rate_limited': self.rate_limited,
+            # Requests that timed out stay queued until the dispatcher next runs
+            'waiting': {
+                priority: sum(not future.done() for future in waiters) for priority, waiters in self._waiters.items()
+            },
+            'granted': dict(self.granted),
+            'expired': dict(self.expired)
+        }
+
+def _parse_number(value):
+    """Parse the leading number of a rate limit header such as '60, 60;w=60'"""
+    if not value:
+        return None
+    try:
+        return float(value.split(',')[0].split(';')[0].strip())
+    except ValueError:
+        return None
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given either as seconds or as an HTTP date"""
+    if not value:
+        return None
+    seconds = _parse_number(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+# Indexed snapshot of the group's roles
+class RoleCatalog:
+    """Read-only snapshot of the group's roles indexed by ID, name and rank number
+    
+    Refreshes build a new catalog and swap it in, so code holding a catalog always sees a
+    consistent set of roles.
+    """
+    
+    # Discord allows at most 25 options per select menu
+    PAGE_SIZE = 25
+    
+    def __init__(self, roles=()):
+        self.sorted = tuple(sorted(roles, key=lambda role: role['rank']))
+        self.by_id = {role['id']: role for role in self.sorted}
+        self.by_name = {role['name']: role for role in self.sorted}
+        self.by_lower_name = {role['name'].lower(): role for role in self.sorted}
+        self.by_rank = {role['rank']: role for role in self.sorted}
+        self.signature = tuple((role['id'], role['name'], role['rank']) for role in self.sorted)
+        self._option_pages = tuple(
+            tuple(
+                discord.SelectOption(
+                    label=role['name'],
+                    description=f"Rank: {role['rank']}",
+                    value=str(role['id'])
+                )
+                for role in self.sorted[start:start + self.PAGE_SIZE]
+            )
+            for start in range(0, len(self.sorted), self.PAGE_SIZE)
+        )
+        self._page_of = {role['id']: index // self.PAGE_SIZE for index, role in enumerate(self.sorted)}
+    
+    def __len__(self):
+        return len(self.sorted)
+    
+    def __iter__(self):
+        return iter(self.sorted)
+    
+    def get(self, identifier):
+        """Find a role by ID, exact name or case-insensitive name"""
+        if isinstance(identifier, int) or str(identifier).isdigit():
+            role = self.by_id.get(int(identifier))
+            if role:
+                return role
+        return self.by_name.get(identifier) or self.by_lower_name.get(str(identifier).lower())
+    
+    @property
+    def page_count(self):
+        return len(self._option_pages)
+    
+    def page_of(self, role_id):
+        return self._page_of.get(role_id, 0)
+    
+    def options_page(self, page, selected_role_id=None):
+        """Select menu options for one page, with the selected role marked as the default"""
+        if not self._option_pages:
+            return []
+        options = list(self._option_pages[page])
+        if self.page_of(selected_role_id) == page and selected_role_id in self.by_id:
+            index = self.sorted.index(self.by_id[selected_role_id]) % self.PAGE_SIZE
+            template = options[index]
+            options[index] = discord.SelectOption(
+                label=template.label,
+                description=template.description,
+                value=template.value,
+                default=True
+            )
+        return options
+
+# Local copy of the group member list
+class RosterMirror:
+    """In-memory index of group members by user ID and by role
+    
+    Roles are paged from the group's member listing in the background. Incremental refreshes
+    only re-page roles whose member count changed; a full refresh catches members who swapped
+    places without changing any count.
+    """
+    
+    def __init__(self, group, refresh_interval=300, full_refresh_interval=3600, max_age=900):
+        self.group = group
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.max_age = max_age
+        self.user_roles = {}  # user_id -> role_id
+        self.role_members = {}  # role_id -> set of user_ids
+        self.member_counts = {}  # role_id -> member count at the last refresh
+        self.synced_at = None
+        self.full_synced_at = None
+        self._task = None
+    
+    def is_fresh(self):
+        return self.synced_at is not None and time.monotonic() - self.synced_at < self.max_age
+    
+    def get_role_id(self, user_id):
+        """Role ID of a group member, or None if the user isn't in the group"""
+        return self.user_roles.get(int(user_id))
+    
+    def members_of(self, role_id):
+        return self.role_members.get(role_id, set())
+    
+    def record_rank_change(self, user_id, role_id):
+        """Apply a rank change made by the bot without waiting for the next refresh"""
+        user_id = int(user_id)
+        old_role_id = self.user_roles.get(user_id)
+        if old_role_id == role_id:
+            return
+        if old_role_id is not None:
+            self.role_members.get(old_role_id, set()).discard(user_id)
+            self.member_counts[old_role_id] = self.member_counts.get(old_role_id, 1) - 1
+        self.user_roles[user_id] = role_id
+        self.role_members.setdefault(role_id, set()).add(user_id)
+        self.member_counts[role_id] = self.member_counts.get(role_id, 0) + 1
+    
+    async def refresh(self, full=False):
+        await self.group.get_group_roles()
+        roles = self.group.roles.by_id
+        
+        # Forget roles that were deleted on Roblox
+        for role_id in set(self.role_members) - set(roles):
+            self._replace_role_members(role_id, set())
+            del self.role_members[role_id]
+            self.member_counts.pop(role_id, None)
+        
+        refreshed = 0
+        for role_id, role in roles.items():
+            # The guest role (rank 0) has no member listing
+            if role.get('rank') == 0:
+                continue
+            if not full and self.member_counts.get(role_id) == role.get('memberCount'):
+                continue
+            members = set()
+            async for member in self.group.get_role_members(role_id):
+                members.add(member['userId'])
+            self._replace_role_members(role_id, members)
+            self.member_counts[role_id] = role.get('memberCount', len(members))
+            refreshed += 1
+        
+        self.synced_at = time.monotonic()
+        if full:
+            self.full_synced_at = self.synced_at
+        logger.info(
+            f"Refreshed {refreshed} roles in the roster mirror of group {self.group.name} "
+            f"({len(self.user_roles)} members)"
+        )
+    
+    def _replace_role_members(self, role_id, members):
+        for user_id in self.role_members.get(role_id, set()) - members:
+            if self.user_roles.get(user_id) == role_id:
+                del self.user_roles[user_id]
+        for user_id in members:
+            old_role_id = self.user_roles.get(user_id)
+            if old_role_id is not None and old_role_id != role_id:
+                self.role_members.get(old_role_id, set()).discard(user_id)
+            self.user_roles[user_id] = role_id
+        self.role_members[role_id] = members
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+    
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    async def _run(self):
+        detach_from_interaction()
+        while True:
+            full = self.full_synced_at is None or time.monotonic() - self.full_synced_at >= self.full_refresh_interval
+            try:
+                await self.refresh(full=full)
+            except Exception as e:
+                logger.error(f"Failed to refresh roster mirror of group {self.group.name}: {e}")
+            await asyncio.sleep(self.refresh_interval)
+    
+    def stats(self):
+        return {
+            'members': len(self.user_roles),
+            'roles': len(self.role_members),
+            'fresh': self.is_fresh(),
+            'age': time.monotonic() - self.synced_at if self.synced_at is not None else None
+        }
 
 # Roblox API wrapper class
 class RobloxAPI:
-    def __init__(self, cookie):
+    MUTATING_METHODS = ('POST', 'PATCH', 'PUT', 'DELETE')
+    
+    def __init__(self, cookie, groups):
         self.cookie = cookie
         self.headers = {
             'Cookie': f'.ROBLOSECURITY={cookie}',
@@ -57,26 +2453,296 @@ class RobloxAPI:
             'User-Agent': 'Discord Ranking Bot'
         }
         self.session = None
+        self.connector = None
+        self.timeouts = {}
+        self.connection_stats = {'created': 0, 'reused': 0, 'dns_hits': 0, 'dns_misses': 0}
         self.csrf_token = None
+        self.csrf_rotations = 0
+        self._csrf_lock = asyncio.Lock()
         self.user_id = None
         self.username = None
-        self.group_roles = {}
+        self.on_roles_changed = None  # Coroutine function called with (group, new RoleCatalog)
+        self._roles_refresh = None
+        self.base_urls = {family: url.rstrip('/') for family, url in config_section('api_urls').items()}
+        rate_config = config_section('rate_limits')
+        weights = {**DEFAULT_CONFIG['rate_limits']['priority_weights'], **rate_config['priority_weights']}
+        self.buckets = {
+            family: TokenBucket(
+                family,
+                weights=weights,
+                **{**DEFAULT_CONFIG['rate_limits']['buckets'].get(family, {}), **rate_config['buckets'].get(family, {})}
+            )
+            for family in ('auth', 'users', 'groups')
+        }
+        autocomplete_config = config_section('autocomplete')
+        self.name_index = NameIndex(
+            max_size=autocomplete_config['max_names'],
+            ttl=autocomplete_config['ttl']
+        )
+        cache_config = config_section('user_cache')
+        self.user_cache = UserCache(
+            max_size=cache_config['max_size'],
+            ttl=cache_config['ttl'],
+            negative_ttl=cache_config['negative_ttl'],
+            on_store=self.name_index.add_user
+        )
+        # Every group shares this session, CSRF token and rate limiters
+        self.groups = {
+            name: RobloxGroup(self, name, group['group_id'], group['suspension_rank_name'])
+            for name, group in groups.items()
+        }
+        self._groups_by_id = {group.group_id: group for group in self.groups.values()}
+    
+    def group_by_id(self, group_id):
+        return self._groups_by_id.get(group_id)
+    
+    def configure_groups(self, groups):
+        """Switch to a new set of group configs, returning (added groups, removed groups)
+        
+        Groups whose name and group ID are unchanged are kept with their roles and roster;
+        only their suspension rank name is updated. Added groups have no roles yet.
+        """
+        current = {}
+        added = []
+        for name, config in groups.items():
+            group = self.groups.get(name)
+            if group and group.group_id == int(config['group_id']):
+                group.suspension_rank_name = config['suspension_rank_name']
+            else:
+                group = RobloxGroup(self, name, config['group_id'], config['suspension_rank_name'])
+                added.append(group)
+            current[name] = group
+        removed = [group for name, group in self.groups.items() if current.get(name) is not group]
+        self.groups = current
+        self._groups_by_id = {group.group_id: group for group in current.values()}
+        return added, removed
+    
+    def configure_rate_limits(self):
+        """Apply the configured bucket rates, sizes and priority weights to the live rate limiters"""
+        rate_config = config_section('rate_limits')
+        weights = {**DEFAULT_CONFIG['rate_limits']['priority_weights'], **rate_config['priority_weights']}
+        for family, bucket in self.buckets.items():
+            settings = {
+                **DEFAULT_CONFIG['rate_limits']['buckets'].get(family, {}),
+                **rate_config['buckets'].get(family, {})
+            }
+            bucket._refill(time.monotonic())
+            bucket.rate = settings['rate']
+            bucket.burst = settings['burst']
+            bucket.tokens = min(bucket.tokens, bucket.burst)
+            # Queued requests keep their place; only the share each class gets from now on changes
+            bucket.weights = {priority: weights.get(priority, weight) for priority, weight in bucket.weights.items()}
+    
+    async def initialize(self, cached_roles=None):
+        """Open the session and load the CSRF token, the bot account and the roles of every group
+        
+        cached_roles maps group names to role snapshots. Those groups are served from their
+        snapshot straight away and the fresh copy is fetched in the background.
+        """
+        self.open_session()
+        cached_roles = cached_roles or {}
+        warm = [group for group in self.groups.values() if cached_roles.get(group.name)]
+        cold = [group for group in self.groups.values() if not cached_roles.get(group.name)]
+        for group in warm:
+            group.roles = RoleCatalog(cached_roles[group.name])
+        await asyncio.gather(
+            self.get_csrf_token(),
+            self.get_auth_user_info(),
+            *(group.get_group_roles() for group in cold)
+        )
+        if warm:
+            self._roles_refresh = asyncio.ensure_future(self.refresh_group_roles(warm))
+        logger.info(f"Initialized Roblox API as {self.username} (ID: {self.user_id}) for {len(self.groups)} groups")
     
-    async def initialize(self):
-        self.session = aiohttp.ClientSession()
-        await self.get_csrf_token()
-        await self.get_auth_user_info()
-        await self.get_group_roles()
-        logger.info(f"Initialized Roblox API as {self.username} (ID: {self.user_id})")
+    async def refresh_group_roles(self, groups=None):
+        """Re-fetch the roles of every group (or only the given ones), logging failures"""
+        groups = list(self.groups.values()) if groups is None else groups
+        results = await asyncio.gather(*(group.get_group_roles() for group in groups), return_exceptions=True)
+        for group, result in zip(groups, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to refresh roles of group {group.name}, keeping the previous ones: {result}")
+    
+    def open_session(self):
+        """Create the HTTP session on the shared connection pool, creating the pool if needed"""
+        http_config = config_section('http')
+        if self.connector is None or self.connector.closed:
+            self.connector = aiohttp.TCPConnector(
+                limit=http_config['limit'],
+                limit_per_host=http_config['limit_per_host'],
+                keepalive_timeout=http_config['keepalive_timeout'],
+                ttl_dns_cache=http_config['dns_cache_ttl'],
+                use_dns_cache=True
+            )
+        
+        trace_configs = []
+        if http_config['trace']:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+            trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+            trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+            trace_configs.append(trace_config)
+        
+        self.timeouts = {
+            name: aiohttp.ClientTimeout(**timeout)
+            for name, timeout in {**DEFAULT_CONFIG['http']['timeouts'], **http_config['timeouts']}.items()
+        }
+        # The session doesn't own the connector so it can be rebuilt without dropping warm connections
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            timeout=self.timeouts['read'],
+            trace_configs=trace_configs
+        )
+    
+    async def set_cookie(self, cookie):
+        """Log in with a new cookie on a new session, going back to the old one if the login fails"""
+        old_cookie, old_session = self.cookie, self.session
+        old_login = (self.csrf_token, self.user_id, self.username)
+        self.cookie = cookie
+        self.headers['Cookie'] = f'.ROBLOSECURITY={cookie}'
+        self.open_session()
+        try:
+            await asyncio.gather(self.get_csrf_token(), self.get_auth_user_info())
+        except Exception:
+            await self.session.close()
+            self.cookie, self.session = old_cookie, old_session
+            self.headers['Cookie'] = f'.ROBLOSECURITY={old_cookie}'
+            self.csrf_token, self.user_id, self.username = old_login
+            if self.csrf_token:
+                self.headers['X-CSRF-TOKEN'] = self.csrf_token
+            raise
+        if old_session:
+            await old_session.close()
+        logger.info(f"Logged in to Roblox as {self.username} (ID: {self.user_id}) with the new cookie")
+    
+    async def rebuild_session(self):
+        """Replace the HTTP session and reload the bot account, keeping pooled connections open"""
+        if self.session:
+            await self.session.close()
+        await self.initialize()
     
     async def close(self):
         if self.session:
             await self.session.close()
+        if self.connector:
+            await self.connector.close()
+    
+    async def _on_connection_created(self, session, context, params):
+        self.connection_stats['created'] += 1
+        metrics.inc('roblox_connections_total', kind='created')
+    
+    async def _on_connection_reused(self, session, context, params):
+        self.connection_stats['reused'] += 1
+        metrics.inc('roblox_connections_total', kind='reused')
+    
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.connection_stats['dns_hits'] += 1
+    
+    async def _on_dns_cache_miss(self, session, context, params):
+        self.connection_stats['dns_misses'] += 1
+    
+    @contextlib.asynccontextmanager
+    async def request(self, family, method, path, rotate_csrf=True, timeout=None, **kwargs):
+        """Send a request to one of the Roblox APIs (auth, users or groups) through its rate limiter
+        
+        timeout names the timeout profile to use ('read', 'mutate' or 'bulk'); by default GETs
+        use 'read' and everything else 'mutate'.
+        
+        429 and 5xx responses (and connection errors) are retried with jittered exponential
+        backoff, waiting at least as long as Retry-After asks. A mutating request rejected
+        because the CSRF token expired is replayed once with the new token. The final
+        response is yielded.
+        
+        The request waits for the rate limiter at the priority in request_priority, and is
+        dropped with an exception if the interaction in request_interaction can no longer be
+        answered by the time it would be sent.
+        """
+        rate_config = config_section('rate_limits')
+        bucket = self.buckets[family]
+        url = self.base_urls[family] + path
+        kwargs['timeout'] = self.timeouts[timeout or ('read' if method == 'GET' else 'mutate')]
+        attempt = 0
+        csrf_replayed = not rotate_csrf or method not in self.MUTATING_METHODS
+        
+        priority = request_priority.get()
+        interaction = request_interaction.get()
+        while True:
+            if not await bucket.acquire(priority, interaction_time_left(interaction)):
+                metrics.inc('roblox_requests_dropped_total', family=family, priority=priority)
+                raise Exception(f"Dropped {method} {path}: the Discord interaction expired before it was sent")
+            backoff = min(rate_config['backoff_max'], rate_config['backoff_base'] * 2 ** attempt)
+            sent_token = self.csrf_token
+            started = time.perf_counter()
+            try:
+                response = await self.session.request(method, url, headers=self.headers, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                metrics.inc('roblox_request_errors_total', endpoint=endpoint_label(method, url), error=type(e).__name__)
+                if attempt >= rate_config['max_retries']:
+                    raise
+                delay = random.uniform(backoff / 2, backoff)
+                logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+            else:
+                metrics.observe(
+                    'roblox_request_seconds',
+                    time.perf_counter() - started,
+                    endpoint=endpoint_label(method, url),
+                    status=response.status
+                )
+                bucket.update_from_headers(response.headers)
+                if response.status == 403 and not csrf_replayed and 'x-csrf-token' in response.headers:
+                    # The CSRF token expired; Roblox sends the replacement with the rejection
+                    new_token = response.headers['x-csrf-token']
+                    response.release()
+                    await self.rotate_csrf_token(sent_token, new_token)
+                    csrf_replayed = True
+                    continue
+                if response.status != 429 and response.status < 500:
+                    break
+                if attempt >= rate_config['max_retries']:
+                    break
+                
+                delay = random.uniform(backoff / 2, backoff)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                if response.status == 429:
+                    bucket.rate_limited += 1
+                    # Pause the whole family so other callers don't hit the limit too
+                    bucket.block_for(delay)
+                response.release()
+                logger.warning(f"{method} {url} returned {response.status}, retrying in {delay:.1f}s")
+            
+            attempt += 1
+            await asyncio.sleep(delay)
+        
+        try:
+            yield response
+        finally:
+            response.release()
+    
+    async def rotate_csrf_token(self, stale_token, new_token=None):
+        """Replace an expired CSRF token, sharing one refresh between concurrent callers"""
+        async with self._csrf_lock:
+            if self.csrf_token != stale_token:
+                # Another request already rotated the token while we waited
+                return
+            if new_token:
+                self.csrf_token = new_token
+                self.headers['X-CSRF-TOKEN'] = new_token
+            else:
+                await self.get_csrf_token()
+            self.csrf_rotations += 1
+            logger.info("Rotated Roblox CSRF token")
+    
+    def rate_limit_state(self):
+        """Current state of every rate limit bucket"""
+        return {family: bucket.state() for family, bucket in self.buckets.items()}
     
     async def get_csrf_token(self):
-        async with self.session.post(
-            'https://auth.roblox.com/v2/logout',
-            headers=self.headers,
+        async with self.request(
+            'auth', 'POST', '/v2/logout',
+            rotate_csrf=False,
             allow_redirects=False
         ) as response:
             self.csrf_token = response.headers.get('x-csrf-token')
@@ -87,9 +2753,8 @@ class RobloxAPI:
                 raise Exception("Failed to get CSRF token")
     
     async def get_auth_user_info(self):
-        async with self.session.get(
-            'https://users.roblox.com/v1/users/authenticated',
-            headers=self.headers
+        async with self.request(
+            'users', 'GET', '/v1/users/authenticated'
         ) as response:
             if response.status == 200:
                 data = await response.json()
@@ -97,157 +2762,812 @@ class RobloxAPI:
                 self.username = data.get('name')
             else:
                 error_text = await response.text()
-                logger.error(f"Failed to get authenticated user info: {error_text}")
-                raise Exception("Invalid Roblox cookie or authentication failed")
+                logger.error(f"Failed to get authenticated user info: {error_text}")
+                raise Exception("Invalid Roblox cookie or authentication failed")
+    
+    async def _fetch_user_by_username(self, username):
+        async with self.request(
+            'users', 'POST', '/v1/usernames/users',
+            json={"usernames": [username], "excludeBannedUsers": True}
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"Username lookup failed with status {response.status}: {error_text}")
+            data = await response.json()
+            users = data.get('data', [])
+            if users:
+                return users[0].get('id'), users[0].get('name')
+            return None
+    
+    async def _fetch_user_by_id(self, user_id):
+        async with self.request(
+            'users', 'GET', f'/v1/users/{user_id}'
+        ) as response:
+            if response.status == 200:
+                data = await response.json()
+                return data.get('id', user_id), data.get('name')
+            if response.status in (400, 404):
+                return None
+            error_text = await response.text()
+            raise Exception(f"User lookup failed with status {response.status}: {error_text}")
+    
+    async def get_user_info(self, user_identifier):
+        """Get user info by either username or user ID"""
+        # Check if user_identifier is a user ID (numeric)
+        if str(user_identifier).isdigit():
+            user_id = int(user_identifier)
+            key = UserCache.id_key(user_id)
+            fetch = lambda: self._fetch_user_by_id(user_id)
+            not_found = (None, None)
+        else:
+            # Assume it's a username
+            key = UserCache.name_key(user_identifier)
+            fetch = lambda: self._fetch_user_by_username(user_identifier)
+            not_found = (None, user_identifier)
+        
+        try:
+            user = await self.user_cache.lookup(key, fetch)
+        except Exception as e:
+            logger.error(f"Failed to look up Roblox user {user_identifier}: {e}")
+            return not_found
+        
+        return user if user else not_found
+    
+    async def get_users_from_usernames(self, usernames):
+        """Resolve many usernames at once, returning {username.lower(): (user_id, username) or None}"""
+        results = {}
+        pending = {}  # username.lower() -> username
+        for username in usernames:
+            key = UserCache.name_key(username)
+            found, value = self.user_cache.get(key)
+            if found:
+                self.user_cache.hits += 1
+                results[key[1]] = value
+            elif key[1] not in results:
+                pending.setdefault(key[1], username)
+        pending = list(pending.values())
+        
+        # The usernames endpoint accepts up to 100 names per request
+        for start in range(0, len(pending), 100):
+            batch = pending[start:start + 100]
+            self.user_cache.misses += len(batch)
+            async with self.request(
+                'users', 'POST', '/v1/usernames/users',
+                timeout='bulk',
+                json={"usernames": batch, "excludeBannedUsers": True}
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Failed to resolve usernames: {error_text}")
+                    for username in batch:
+                        results[username.lower()] = None
+                    continue
+                data = await response.json()
+            
+            found_names = set()
+            for user in data.get('data', []):
+                requested = user.get('requestedUsername', user.get('name', '')).lower()
+                found_names.add(requested)
+                self.user_cache.store_user(user['id'], user.get('name'))
+                if requested != user.get('name', '').lower():
+                    self.user_cache.set(UserCache.name_key(requested), (user['id'], user.get('name')))
+                results[requested] = (user['id'], user.get('name'))
+            for username in batch:
+                if username.lower() not in found_names:
+                    self.user_cache.set(UserCache.name_key(username), None)
+                    results[username.lower()] = None
+        
+        return results
+    
+    async def get_users_from_ids(self, user_ids):
+        """Resolve many user IDs at once, returning {user_id: (user_id, username) or None}"""
+        results = {}
+        pending = []
+        for user_id in user_ids:
+            user_id = int(user_id)
+            found, value = self.user_cache.get(UserCache.id_key(user_id))
+            if found:
+                self.user_cache.hits += 1
+                results[user_id] = value
+            elif user_id not in results and user_id not in pending:
+                pending.append(user_id)
+        
+        for start in range(0, len(pending), 100):
+            batch = pending[start:start + 100]
+            self.user_cache.misses += len(batch)
+            async with self.request(
+                'users', 'POST', '/v1/users',
+                timeout='bulk',
+                json={"userIds": batch, "excludeBannedUsers": True}
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Failed to resolve user IDs: {error_text}")
+                    for user_id in batch:
+                        results[user_id] = None
+                    continue
+                data = await response.json()
+            
+            for user in data.get('data', []):
+                self.user_cache.store_user(user['id'], user.get('name'))
+                results[user['id']] = (user['id'], user.get('name'))
+            for user_id in batch:
+                if user_id not in results:
+                    self.user_cache.set(UserCache.id_key(user_id), None)
+                    results[user_id] = None
+        
+        return results
+    
+    async def get_users_info(self, user_identifiers):
+        """Resolve a list of usernames and/or user IDs, returning [(identifier, user_id, username)]"""
+        names = [i for i in user_identifiers if not str(i).isdigit()]
+        ids = [int(i) for i in user_identifiers if str(i).isdigit()]
+        by_name, by_id = await asyncio.gather(
+            self.get_users_from_usernames(names),
+            self.get_users_from_ids(ids)
+        )
+        
+        resolved = []
+        for identifier in user_identifiers:
+            if str(identifier).isdigit():
+                user = by_id.get(int(identifier))
+            else:
+                user = by_name.get(str(identifier).lower())
+            if user:
+                resolved.append((identifier, user[0], user[1]))
+            else:
+                resolved.append((identifier, None, None))
+        return resolved
+    
+    async def get_user_group_roles(self, user_id):
+        """Get the user's role in every group they are in as {group_id: role}"""
+        async with self.request(
+            'groups', 'GET', f'/v2/users/{user_id}/groups/roles'
+        ) as response:
+            if response.status != 200:
+                # An empty result would read as "not in any group", so a failure must raise
+                error_text = await response.text()
+                raise Exception(f"Failed to get groups of user ID {user_id}: {error_text}")
+            data = await response.json()
+        return {
+            entry.get('group', {}).get('id'): entry.get('role', {})
+            for entry in data.get('data', [])
+        }
+
+# One Roblox group managed through the shared API client
+class RobloxGroup:
+    """A Roblox group managed by the bot, with its own role catalog and roster mirror
+    
+    The HTTP session, CSRF token, rate limiters and user cache all belong to the RobloxAPI
+    the group was created by, so managing more groups costs no extra connections or logins.
+    """
+    
+    def __init__(self, api, name, group_id, suspension_rank_name='Customer'):
+        self.api = api
+        self.name = name
+        self.group_id = int(group_id)
+        self.suspension_rank_name = suspension_rank_name
+        self.roles = RoleCatalog()
+        roster_config = config_section('roster_mirror')
+        self.roster = RosterMirror(
+            self,
+            refresh_interval=roster_config['refresh_interval'],
+            full_refresh_interval=roster_config['full_refresh_interval'],
+            max_age=roster_config['max_age']
+        ) if roster_config['enabled'] else None
+    
+    def __repr__(self):
+        return f"RobloxGroup({self.name!r}, {self.group_id})"
     
     async def get_group_roles(self):
-        async with self.session.get(
-            f'https://groups.roblox.com/v1/groups/{CONFIG["group_id"]}/roles',
-            headers=self.headers
+        async with self.api.request(
+            'groups', 'GET', f'/v1/groups/{self.group_id}/roles'
         ) as response:
             if response.status == 200:
                 data = await response.json()
-                self.group_roles = {role['name']: role for role in data.get('roles', [])}
-                logger.info(f"Loaded {len(self.group_roles)} group roles")
+                catalog = RoleCatalog(data.get('roles', []))
+                changed = catalog.signature != self.roles.signature
+                # Swap in the new snapshot in one step
+                self.roles = catalog
+                if changed:
+                    logger.info(f"Loaded {len(catalog)} roles for group {self.name}")
+                    if self.api.on_roles_changed:
+                        await self.api.on_roles_changed(self, catalog)
             else:
                 error_text = await response.text()
                 logger.error(f"Failed to get group roles: {error_text}")
-                raise Exception(f"Failed to get roles for group {CONFIG['group_id']}")
+                raise Exception(f"Failed to get roles for group {self.group_id}")
     
-    async def get_user_id_from_username(self, username):
-        async with self.session.post(
-            'https://users.roblox.com/v1/usernames/users',
-            headers=self.headers,
-            json={"usernames": [username], "excludeBannedUsers": True}
-        ) as response:
-            if response.status == 200:
+    async def get_role_members(self, role_id):
+        """Page through every member of a group role"""
+        cursor = None
+        while True:
+            params = {"limit": 100, "sortOrder": "Asc"}
+            if cursor:
+                params["cursor"] = cursor
+            async with self.api.request(
+                'groups', 'GET', f'/v1/groups/{self.group_id}/roles/{role_id}/users',
+                timeout='bulk',
+                params=params
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"Failed to list members of role {role_id}: {error_text}")
                 data = await response.json()
-                users = data.get('data', [])
-                if users:
-                    return users[0].get('id')
-            return None
-    
-    async def get_user_info(self, user_identifier):
-        """Get user info by either username or user ID"""
-        user_id = None
-        username = None
-        
-        # Check if user_identifier is a user ID (numeric)
-        if str(user_identifier).isdigit():
-            user_id = int(user_identifier)
-            url = f'https://users.roblox.com/v1/users/{user_id}'
-            async with self.session.get(url, headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    username = data.get('name')
-                else:
-                    return None, None
-        else:
-            # Assume it's a username
-            username = user_identifier
-            user_id = await self.get_user_id_from_username(username)
-            
-        return user_id, username
+            for member in data.get('data', []):
+                yield member
+            cursor = data.get('nextPageCursor')
+            if not cursor:
+                return
     
     async def get_user_rank(self, user_id):
-        async with self.session.get(
-            f'https://groups.roblox.com/v2/users/{user_id}/groups/roles',
-            headers=self.headers
-        ) as response:
-            if response.status == 200:
-                data = await response.json()
-                for group in data.get('data', []):
-                    if group.get('group', {}).get('id') == CONFIG['group_id']:
-                        role = group.get('role', {})
-                        return {
-                            'id': role.get('id'),
-                            'name': role.get('name'),
-                            'rank': role.get('rank')
-                        }
+        # Serve the rank from the roster mirror when it is up to date. Users it doesn't know may
+        # have joined since the last refresh, so they are looked up on Roblox
+        if self.roster and self.roster.is_fresh():
+            role_id = self.roster.get_role_id(user_id)
+            role = self.roles.by_id.get(role_id) if role_id is not None else None
+            if role:
+                return {
+                    'id': role['id'],
+                    'name': role['name'],
+                    'rank': role['rank']
+                }
+        
+        role = (await self.api.get_user_group_roles(user_id)).get(self.group_id)
+        if role is None:
             return None
+        return {
+            'id': role.get('id'),
+            'name': role.get('name'),
+            'rank': role.get('rank')
+        }
     
     async def set_rank(self, user_id, role_id):
-        async with self.session.patch(
-            f'https://groups.roblox.com/v1/groups/{CONFIG["group_id"]}/users/{user_id}',
-            headers=self.headers,
+        async with self.api.request(
+            'groups', 'PATCH', f'/v1/groups/{self.group_id}/users/{user_id}',
             json={"roleId": role_id}
         ) as response:
             success = response.status == 200
             if not success:
                 error_text = await response.text()
-                logger.error(f"Failed to set rank: {error_text}")
+                logger.error(f"Failed to set rank in group {self.name}: {error_text}")
+            elif self.roster:
+                self.roster.record_rank_change(user_id, role_id)
             return success
     
+    async def set_rank_many(self, user_ids, role_id, concurrency=None, on_result=None):
+        """Set the same rank for many users with bounded concurrency, returning {user_id: success}
+        
+        on_result(user_id, success) is called as each rank change finishes.
+        """
+        if concurrency is None:
+            concurrency = config_section('bulk_rank')['concurrency']
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        results = {}
+        
+        async def rank_one(user_id):
+            async with semaphore:
+                try:
+                    success = await self.set_rank(user_id, role_id)
+                except Exception as e:
+                    logger.error(f"Failed to set rank for user ID {user_id}: {e}")
+                    success = False
+            results[user_id] = success
+            if on_result:
+                on_result(user_id, success)
+        
+        await asyncio.gather(*(rank_one(user_id) for user_id in user_ids))
+        return results
+    
     async def set_group_shout(self, message):
-        async with self.session.patch(
-            f'https://groups.roblox.com/v1/groups/{CONFIG["group_id"]}/status',
-            headers=self.headers,
+        async with self.api.request(
+            'groups', 'PATCH', f'/v1/groups/{self.group_id}/status',
             json={"message": message}
         ) as response:
             success = response.status == 200
             if not success:
                 error_text = await response.text()
-                logger.error(f"Failed to set group shout: {error_text}")
+                logger.error(f"Failed to set shout of group {self.name}: {error_text}")
             return success
     
     async def clear_group_shout(self):
         return await self.set_group_shout("")
 
+# Permission checks for commands
+class PermissionResolver:
+    """Caches the set of bot permissions granted by each combination of Discord roles
+    
+    Permissions come from the Discord role IDs in CONFIG['roles']; the developer permission
+    implies every other one. The cache is keyed by the member's current role IDs, which every
+    interaction carries, so a role change takes effect on the next command without member
+    events. Staff share a handful of role combinations, so the cache stays small.
+    """
+    
+    PERMISSIONS = ('ranking_permit', 'suspension_permit', 'developer')
+    
+    def __init__(self, roles_config):
+        self._role_permissions = {}  # Discord role ID -> permissions granted by that role
+        self._role_sets = {}  # frozenset of Discord role IDs -> frozenset of permissions
+        self.rebuild(roles_config)
+    
+    def rebuild(self, roles_config):
+        """Recompute which permissions each configured role grants and drop cached members"""
+        role_permissions = {}
+        for permission, role_id in roles_config.items():
+            if not role_id:
+                continue
+            granted = self.PERMISSIONS if permission == 'developer' else (permission,)
+            role_permissions.setdefault(int(role_id), set()).update(granted)
+        self._role_permissions = {role_id: frozenset(granted) for role_id, granted in role_permissions.items()}
+        self._role_sets.clear()
+    
+    def permissions_for(self, member):
+        key = frozenset(role.id for role in member.roles)
+        permissions = self._role_sets.get(key)
+        if permissions is None:
+            permissions = frozenset().union(*(self._role_permissions.get(role_id, ()) for role_id in key))
+            self._role_sets[key] = permissions
+        return permissions
+    
+    def has(self, interaction, permission):
+        if not interaction.guild or not isinstance(interaction.user, discord.Member):
+            return False
+        return permission in self.permissions_for(interaction.user)
+
+def command_tree_hash(tree, application_id):
+    """Fingerprint of every command in the tree, used to skip unnecessary syncs"""
+    payload = []
+    for command in sorted(tree.get_commands(), key=lambda command: command.name):
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:
+            # discord.py before 2.4 doesn't take the tree
+            payload.append(command.to_dict())
+    data = json.dumps({'application_id': application_id, 'commands': payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
 # Bot class
-class RobloxRankingBot(commands.Bot):
+class RobloxRankingBot(commands.AutoShardedBot):
     def __init__(self):
+        cluster_config = config_section('cluster')
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(command_prefix='!', intents=intents)
-        self.roblox_api = RobloxAPI(CONFIG['cookie'])
+        if cluster_config['shard_ids'] is not None and cluster_config['shard_count'] is None:
+            raise Exception("cluster.shard_count must be set when cluster.shard_ids is")
+        super().__init__(
+            command_prefix='!',
+            intents=intents,
+            shard_ids=cluster_config['shard_ids'],
+            shard_count=cluster_config['shard_count']
+        )
+        self.permission_resolver = PermissionResolver(CONFIG['roles'])
+        self.roblox_api = RobloxAPI(CONFIG['cookie'], group_configs())
+        self.store = StateStore(CONFIG.get('state_db', DEFAULT_CONFIG['state_db']))
+        self.expiry_scheduler = ExpiryScheduler(self.check_expirations)
+        self.ready_logged = False
+        job_config = config_section('rank_jobs')
+        self.rank_jobs = RankJobQueue(
+            self.roblox_api,
+            self.store,
+            on_complete=self.on_rank_job_complete,
+            on_superseded=self.on_rank_job_superseded,
+            concurrency=job_config['concurrency'],
+            max_attempts=job_config['max_attempts'],
+            retry_base=job_config['retry_base'],
+            retry_max=job_config['retry_max']
+        )
+        restore_config = config_section('restores')
+        self.restore_pipeline = RestorePipeline(
+            self.roblox_api,
+            self.store,
+            on_restored=self.on_suspension_restored,
+            on_skipped=self.on_restore_skipped,
+            rank_jobs=self.rank_jobs,
+            concurrency=restore_config['concurrency'],
+            retry_base=restore_config['retry_base'],
+            retry_max=restore_config['retry_max']
+        )
+        reconciliation_config = config_section('reconciliation')
+        self.reconciler = SuspensionReconciler(
+            self.roblox_api,
+            self.store,
+            interval=reconciliation_config['interval'],
+            grace_period=reconciliation_config['grace_period']
+        ) if reconciliation_config['enabled'] else None
+        # With several workers only the lease holder runs sweeps, restores and queued rank changes
+        self.worker_id = cluster_config['worker_id'] or f"{socket.gethostname()}-{os.getpid()}"
+        self.leader_lease = LeaderLease(
+            self.store,
+            'leader',
+            self.worker_id,
+            ttl=cluster_config['lease_ttl'],
+            renew_interval=cluster_config['renew_interval'],
+            on_acquired=self.start_singleton_work,
+            on_lost=self.stop_singleton_work
+        ) if cluster_config['enabled'] else None
+        audit_config = config_section('audit_log')
+        audit_directory = audit_config['directory']
+        if self.leader_lease:
+            # Workers can't share one log, so each keeps its own
+            audit_directory = os.path.join(audit_directory, self.worker_id)
+        self.audit_log = AuditLog(audit_directory, segment_size=audit_config['segment_size'])
+        # The leader records rank jobs, restores and expiries, so /history reads every worker's log
+        self.audit_history = (
+            AuditLogSet(self.audit_log, audit_config['directory']) if self.leader_lease else self.audit_log
+        )
+        self.config_mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        self._config_lock = asyncio.Lock()
+        self.loop_monitor = LoopMonitor()
+        self.configure_diagnostics()
         
     async def setup_hook(self):
-        await self.roblox_api.initialize()
-        self.check_expirations.start()
-        await self.tree.sync()
-        logger.info("Bot commands synced")
+        started = time.perf_counter()
+        
+        # Start from the last known group roles so commands work before the refresh finishes
+        groups = list(self.roblox_api.groups.values())
+        snapshots = await asyncio.gather(*(self.store.get_meta(f'group_roles:{group.group_id}') for group in groups))
+        cached_roles = {group.name: snapshot for group, snapshot in zip(groups, snapshots)}
+        self.roblox_api.on_roles_changed = self.save_roles_snapshot
+        await asyncio.gather(
+            self.store.migrate_from_config(CONFIG),
+            self.roblox_api.initialize(cached_roles=cached_roles)
+        )
+        if self.leader_lease:
+            self.leader_lease.start()
+        else:
+            await self.start_singleton_work()
+        self.refresh_roles.change_interval(seconds=CONFIG.get('role_refresh_interval', DEFAULT_CONFIG['role_refresh_interval']))
+        self.refresh_roles.start()
+        for group in groups:
+            if group.roster:
+                group.roster.start()
+        if config_section('diagnostics')['enabled']:
+            self.loop_monitor.start()
+        watch_config = config_section('config_reload')
+        if watch_config['watch']:
+            self.watch_config.change_interval(seconds=watch_config['interval'])
+            self.watch_config.start()
+        if metrics.enabled:
+            metrics.add_collector(self.collect_metrics)
+            metrics_config = config_section('metrics')
+            await metrics.start_server(metrics_config['host'], metrics_config['port'])
+        self.tree.on_error = self.on_app_command_error
+        self.tree.interaction_check = self.tag_interaction
+        await self.sync_commands()
+        logger.info(f"Setup finished in {(time.perf_counter() - started) * 1000:.0f}ms")
+    
+    async def close(self):
+        if self.leader_lease:
+            await self.leader_lease.stop()
+        else:
+            await self.stop_singleton_work()
+        self.refresh_roles.cancel()
+        self.watch_config.cancel()
+        self.loop_monitor.stop()
+        for group in self.roblox_api.groups.values():
+            if group.roster:
+                group.roster.stop()
+        await metrics.stop_server()
+        await self.roblox_api.close()
+        await super().close()
+    
+    @property
+    def is_leader(self):
+        return self.leader_lease is None or self.leader_lease.held
+    
+    async def start_singleton_work(self):
+        """Start the work only one worker may run: expiry sweeps, restores, reconciliation and queued rank changes"""
+        await self.schedule_stored_expirations()
+        await self.rank_jobs.start()
+        self.restore_pipeline.start()
+        self.expiry_scheduler.start()
+        if self.reconciler:
+            self.reconciler.start()
+        if self.leader_lease:
+            self.poll_shared_work.change_interval(seconds=config_section('cluster')['poll_interval'])
+            self.poll_shared_work.start()
+    
+    async def stop_singleton_work(self):
+        self.poll_shared_work.cancel()
+        if self.reconciler:
+            self.reconciler.stop()
+        self.expiry_scheduler.stop()
+        self.expiry_scheduler.clear()
+        self.restore_pipeline.stop()
+        self.rank_jobs.stop()
+    
+    @tasks.loop(seconds=5)
+    async def poll_shared_work(self):
+        """Pick up deadlines and rank changes that other workers wrote to the store"""
+        detach_from_interaction()
+        try:
+            await self.check_expirations()
+            await self.rank_jobs.poll()
+        except Exception as e:
+            logger.error(f"Failed to poll for shared work: {e}")
+    
+    def schedule_expiry(self, kind, group_id, user_id, until):
+        # Other workers leave new deadlines to the leader, which polls the store for them
+        if self.is_leader:
+            self.expiry_scheduler.schedule(kind, group_id, user_id, until)
     
     async def on_ready(self):
         logger.info(f'Logged in as {self.user.name} (ID: {self.user.id})')
+        if not self.ready_logged:
+            self.ready_logged = True
+            logger.info(f"Cold start took {time.perf_counter() - PROCESS_STARTED:.2f}s")
         await self.change_presence(activity=discord.Game(name="/rank | Roblox Ranking"))
     
-    @tasks.loop(minutes=5)
-    async def check_expirations(self):
+    async def sync_commands(self):
+        """Sync the command tree with Discord only when it changed since the last sync"""
+        tree_hash = command_tree_hash(self.tree, self.application_id)
+        if tree_hash == await self.store.get_meta('command_tree_hash'):
+            logger.info("Bot commands unchanged, skipping sync")
+            return
+        await self.tree.sync()
+        await self.store.set_meta('command_tree_hash', tree_hash)
+        logger.info("Bot commands synced")
+    
+    async def edit_job_message(self, context, **fields):
+        """Edit the Discord message a queued rank change was requested from"""
+        if not context.get('channel_id') or not context.get('message_id'):
+            return
+        channel = self.get_channel(context['channel_id']) or await self.fetch_channel(context['channel_id'])
+        await channel.get_partial_message(context['message_id']).edit(**fields)
+    
+    async def on_rank_job_complete(self, job, success):
+        context = job['context']
+        username = context.get('username', job['user_id'])
+        group = self.roblox_api.group_by_id(job['group_id'])
+        role = group.roles.by_id.get(job['role_id']) if group else None
+        role_name = role['name'] if role else context.get('role_name', job['role_id'])
+        
+        if not success:
+            await self.edit_job_message(context, content=f"Failed to set rank for {username}.", embed=None, view=None)
+            return
+        
+        embed = discord.Embed(
+            title="Rank Update Successful",
+            description=f"Successfully ranked {username} to {role_name}",
+            color=discord.Color.green(),
+            timestamp=datetime.datetime.now()
+        )
+        embed.add_field(name="Previous Rank", value=context.get('previous_rank', 'Unknown'), inline=True)
+        embed.add_field(name="New Rank", value=role_name, inline=True)
+        embed.set_footer(text=f"Ranked by {context.get('requested_by', 'unknown')}")
+        await self.audit_log.record(
+            'rank',
+            group_id=job['group_id'],
+            user_id=job['user_id'],
+            username=context.get('username'),
+            moderator_id=context.get('requested_by_id'),
+            moderator=context.get('requested_by'),
+            from_role=context.get('previous_rank'),
+            to_role=role_name
+        )
+        await self.edit_job_message(context, content=None, embed=embed, view=None)
+    
+    async def on_rank_job_superseded(self, job, reason):
+        username = job['context'].get('username', job['user_id'])
+        await self.edit_job_message(
+            job['context'], content=f"Rank change for {username} replaced by {reason}.", embed=None, view=None
+        )
+    
+    async def on_suspension_restored(self, suspension):
+        group = self.roblox_api.group_by_id(suspension['group_id'])
+        role = group.roles.by_id.get(suspension['original_rank']) if group else None
+        await self.audit_log.record(
+            'restore',
+            group_id=suspension['group_id'],
+            user_id=suspension['user_id'],
+            to_role=role['name'] if role else suspension['original_rank']
+        )
+    
+    async def on_restore_skipped(self, suspension, drift):
+        await self.audit_log.record(
+            'restore_skipped',
+            group_id=suspension['group_id'],
+            user_id=suspension['user_id'],
+            reason=drift
+        )
+    
+    async def save_roles_snapshot(self, group, catalog):
+        await self.store.set_meta(f'group_roles:{group.group_id}', list(catalog.sorted))
+    
+    async def on_app_command_completion(self, interaction, command):
+        metrics.observe(
+            'command_seconds',
+            (discord.utils.utcnow() - interaction.created_at).total_seconds(),
+            command=command.qualified_name,
+            outcome='ok'
+        )
+    
+    async def tag_interaction(self, interaction):
+        """Send the Roblox requests of every command and autocomplete at interactive priority"""
+        # Set on the task handling the interaction, so only its own requests are affected
+        request_priority.set('interactive')
+        request_interaction.set(interaction)
+        return True
+    
+    async def on_app_command_error(self, interaction, error):
+        command = interaction.command.qualified_name if interaction.command else 'unknown'
+        metrics.inc('command_errors_total', command=command, error=type(getattr(error, 'original', error)).__name__)
+        metrics.observe(
+            'command_seconds',
+            (discord.utils.utcnow() - interaction.created_at).total_seconds(),
+            command=command,
+            outcome='error'
+        )
+        logger.error(f"Error in command {command}: {error}", exc_info=error)
+    
+    async def collect_metrics(self):
+        counts = await self.store.counts()
+        metrics.set('active_rank_bans', counts['rank_bans'])
+        metrics.set('active_suspensions', counts['suspensions'])
+        metrics.set('drifted_suspensions', counts['drifted_suspensions'])
+        
+        restore_stats = self.restore_pipeline.stats()
+        metrics.set('restore_queue_depth', restore_stats['queued'] + restore_stats['waiting_retry'])
+        metrics.set('restores_total', restore_stats['restored'])
+        metrics.set('restore_failures_total', restore_stats['failures'])
+        metrics.set('restores_skipped_total', restore_stats['skipped'])
+        
+        job_stats = self.rank_jobs.stats()
+        metrics.set('rank_job_queue_depth', job_stats['queued'] + job_stats['waiting_retry'])
+        for result in ('completed', 'failed', 'superseded'):
+            metrics.set('rank_jobs_total', job_stats[result], result=result)
+        
+        metrics.set('cluster_leader', 1 if self.is_leader else 0)
+        
+        cache_stats = self.roblox_api.user_cache.stats()
+        for result in ('hits', 'misses', 'coalesced'):
+            metrics.set('user_cache_lookups_total', cache_stats[result], result=result)
+        for family, state in self.roblox_api.rate_limit_state().items():
+            metrics.set('rate_limit_tokens', state['tokens'], family=family)
+            for priority, waiting in state['waiting'].items():
+                metrics.set('rate_limit_waiting', waiting, family=family, priority=priority)
+    
+    @tasks.loop(minutes=10)
+    async def refresh_roles(self):
+        """Pick up roles that were added, renamed or re-ranked on Roblox"""
+        detach_from_interaction()
+        await self.roblox_api.refresh_group_roles()
+    
+    @tasks.loop(seconds=5)
+    async def watch_config(self):
+        """Reload the config when the file changes on disk"""
+        detach_from_interaction()
+        try:
+            if os.stat(CONFIG_PATH).st_mtime_ns == self.config_mtime:
+                return
+            await self.reload_config()
+        except Exception as e:
+            logger.error(f"Failed to reload config: {e}")
+    
+    async def reload_config(self):
+        """Re-read the config file and apply the sections that changed
+        
+        Returns (applied, needs_restart): the changed sections now in effect, and those that
+        only take full effect after a restart. Stored rank bans and suspensions are never
+        touched. If the file is invalid, or a new cookie can't log in, nothing is applied; if
+        applying a section fails, the previous config is put back.
+        """
+        async with self._config_lock:
+            # Taken before reading so a change made while reloading is picked up next time
+            self.config_mtime = os.stat(CONFIG_PATH).st_mtime_ns
+            new_config = load_config()
+            problems = validate_config(new_config)
+            if problems:
+                raise Exception("Invalid config: " + "; ".join(problems))
+            changed = sorted(key for key in set(CONFIG) | set(new_config) if CONFIG.get(key) != new_config.get(key))
+            if not changed:
+                return [], []
+            
+            if 'cookie' in changed:
+                await self.roblox_api.set_cookie(new_config['cookie'])
+            old_config = dict(CONFIG)
+            CONFIG.clear()
+            CONFIG.update(new_config)
+            try:
+                await self.apply_config(changed)
+            except Exception:
+                CONFIG.clear()
+                CONFIG.update(old_config)
+                try:
+                    if 'cookie' in changed:
+                        await self.roblox_api.set_cookie(old_config['cookie'])
+                    await self.apply_config(changed)
+                except Exception as e:
+                    logger.error(f"Failed to put the previous config back in effect: {e}")
+                raise
+            
+            applied = [key for key in changed if key in RELOADABLE_CONFIG]
+            needs_restart = [key for key in changed if key not in RELOADABLE_CONFIG]
+            logger.info(f"Reloaded config: applied {applied or 'nothing'}, needs a restart: {needs_restart or 'nothing'}")
+            return applied, needs_restart
+    
+    async def apply_config(self, changed):
+        """Put the changed sections of CONFIG into effect"""
+        if {'group_id', 'groups', 'suspension_rank_name'} & set(changed):
+            await self.apply_group_configs()
+        if 'roles' in changed:
+            self.permission_resolver.rebuild(CONFIG['roles'])
+        if 'role_refresh_interval' in changed:
+            self.refresh_roles.change_interval(
+                seconds=CONFIG.get('role_refresh_interval', DEFAULT_CONFIG['role_refresh_interval'])
+            )
+        if 'rate_limits' in changed:
+            self.roblox_api.configure_rate_limits()
+        if 'diagnostics' in changed:
+            self.configure_diagnostics()
+            if config_section('diagnostics')['enabled']:
+                start_detached(self.loop_monitor.start)
+            else:
+                self.loop_monitor.stop()
+        if 'config_reload' in changed:
+            watch_config = config_section('config_reload')
+            self.watch_config.change_interval(seconds=watch_config['interval'])
+            if not watch_config['watch']:
+                self.watch_config.cancel()
+            elif not self.watch_config.is_running():
+                # Started from /reloadconfig, the loop would otherwise inherit its interaction
+                start_detached(self.watch_config.start)
+    
+    def configure_diagnostics(self):
+        """Apply the diagnostics settings to the loop monitor, whether or not it is running"""
+        diagnostics_config = config_section('diagnostics')
+        self.loop_monitor.configure(
+            lag_interval=diagnostics_config['lag_interval'],
+            slow_callback=diagnostics_config['slow_callback'],
+            profile_interval=diagnostics_config['profile_interval']
+        )
+    
+    async def apply_group_configs(self):
+        """Bring the managed groups in line with the config, fetching roles only for new group IDs"""
+        added, removed = self.roblox_api.configure_groups(group_configs())
+        for group in removed:
+            if group.roster:
+                group.roster.stop()
+        await self.roblox_api.refresh_group_roles(added)
+        for group in added:
+            if group.roster:
+                start_detached(group.roster.start)
+        if added or removed:
+            logger.info(
+                f"Groups changed: added {[group.name for group in added]}, removed {[group.name for group in removed]}"
+            )
+    
+    async def schedule_stored_expirations(self):
+        """Load every stored deadline into the expiry scheduler"""
+        for group_id, user_id, until in await self.store.all_rank_bans():
+            self.expiry_scheduler.schedule('rank_ban', group_id, user_id, until)
+            self.roblox_api.name_index.add_user(user_id)
+        for group_id, user_id, until in await self.store.all_suspensions():
+            self.expiry_scheduler.schedule('suspension', group_id, user_id, until)
+            self.roblox_api.name_index.add_user(user_id)
+        logger.info(f"Scheduled {len(self.expiry_scheduler)} rank ban and suspension expirations")
+    
+    async def check_expirations(self, due=()):
         """Check for expired rank bans and suspensions"""
+        # The scheduler only decides when to look; the indexed queries decide what expired
+        started = time.perf_counter()
         current_time = datetime.datetime.now().timestamp()
         
         # Check rank bans
-        expired_bans = []
-        for user_id, ban_info in CONFIG['rank_bans'].items():
-            if ban_info['until'] < current_time:
-                expired_bans.append(user_id)
-        
-        for user_id in expired_bans:
-            del CONFIG['rank_bans'][user_id]
-            logger.info(f"Rank ban expired for user ID {user_id}")
-        
-        # Check suspensions
-        expired_suspensions = []
-        for user_id, suspension_info in CONFIG['suspensions'].items():
-            if suspension_info['until'] < current_time:
-                expired_suspensions.append((user_id, suspension_info['original_rank']))
-        
-        for user_id, original_rank in expired_suspensions:
-            # Restore original rank
-            success = await self.roblox_api.set_rank(user_id, original_rank)
-            if success:
-                del CONFIG['suspensions'][user_id]
-                logger.info(f"Suspension expired for user ID {user_id}, restored to rank {original_rank}")
-            else:
-                logger.error(f"Failed to restore rank for user ID {user_id}")
+        expired_bans = await self.store.pop_expired_rank_bans(current_time)
+        for group_id, user_id in expired_bans:
+            logger.info(f"Rank ban expired for user ID {user_id} in group {group_id}")
+        if expired_bans:
+            await self.audit_log.record_many([
+                AuditLog.make_record('rank_ban_expired', group_id=group_id, user_id=user_id)
+                for group_id, user_id in expired_bans
+            ])
         
-        # Save changes if any expirations were processed
-        if expired_bans or expired_suspensions:
-            save_config()
-    
-    @check_expirations.before_loop
-    async def before_check_expirations(self):
-        await self.wait_until_ready()
+        # Hand expired suspensions to the restore workers so a slow restore never blocks the next deadline
+        for suspension in await self.store.expired_suspensions(current_time):
+            self.restore_pipeline.submit(suspension)
+        
+        metrics.observe('expiry_sweep_seconds', time.perf_counter() - started)
 
 # Create bot instance
 bot = RobloxRankingBot()
@@ -255,25 +3575,45 @@ bot = RobloxRankingBot()
 # Helper functions
 def has_permission(interaction, permission_type):
     """Check if a user has the specified permission based on role"""
-    if not interaction.guild:
-        return False
-    
-    role_id = CONFIG['roles'].get(permission_type)
-    if not role_id:
-        return False
-    
-    role = interaction.guild.get_role(role_id)
-    if not role:
-        return False
-    
-    # Developer role can do everything
-    dev_role_id = CONFIG['roles'].get('developer')
-    if dev_role_id:
-        dev_role = interaction.guild.get_role(dev_role_id)
-        if dev_role and dev_role in interaction.user.roles:
-            return True
-    
-    return role in interaction.user.roles
+    return bot.permission_resolver.has(interaction, permission_type)
+
+def require_permission(permission_type):
+    """Only run a command for users with the given permission (developers always pass)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            if not has_permission(interaction, permission_type):
+                await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+                return
+            return await func(interaction, *args, **kwargs)
+        return wrapper
+    return decorator
+
+async def user_identifier_autocomplete(interaction: discord.Interaction, current: str):
+    """Suggest usernames and user IDs the bot already knows, without calling Roblox"""
+    if not (has_permission(interaction, 'ranking_permit') or has_permission(interaction, 'suspension_permit')):
+        return []
+    return [
+        app_commands.Choice(name=label[:100], value=value)
+        for label, value in bot.roblox_api.name_index.search(current)
+    ]
+
+def resolve_group(interaction, name=None):
+    """Find a managed group by name or group ID, defaulting to the group set for the interaction's server"""
+    if not name:
+        name = CONFIG.get('guild_groups', {}).get(str(interaction.guild_id), MAIN_GROUP)
+    group = bot.roblox_api.groups.get(name)
+    if group is None and str(name).isdigit():
+        group = bot.roblox_api.group_by_id(int(name))
+    return group
+
+async def group_autocomplete(interaction: discord.Interaction, current: str):
+    current = current.lower()
+    return [
+        app_commands.Choice(name=f"{group.name} ({group.group_id})", value=group.name)
+        for group in bot.roblox_api.groups.values()
+        if current in group.name.lower() or current in str(group.group_id)
+    ][:25]
 
 def parse_time(time_str):
     """Parse time string like '30d' or '12h' into seconds"""
@@ -297,12 +3637,63 @@ def parse_time(time_str):
     else:
         return 0
 
+class RankSelectView(discord.ui.View):
+    """Select menu of group roles, paged to stay within Discord's 25 option limit"""
+    
+    def __init__(self, catalog, current_role_id, on_select, timeout=60):
+        super().__init__(timeout=timeout)
+        self.catalog = catalog
+        self.current_role_id = current_role_id
+        self.on_select = on_select
+        self.page = catalog.page_of(current_role_id)
+        
+        self.select = discord.ui.Select(min_values=1, max_values=1, options=[])
+        self.select.callback = self.select_callback
+        self.add_item(self.select)
+        
+        if catalog.page_count > 1:
+            self.previous_button = discord.ui.Button(label="Previous", style=discord.ButtonStyle.secondary)
+            self.previous_button.callback = self.previous_callback
+            self.next_button = discord.ui.Button(label="Next", style=discord.ButtonStyle.secondary)
+            self.next_button.callback = self.next_callback
+            self.add_item(self.previous_button)
+            self.add_item(self.next_button)
+        self.show_page(self.page)
+    
+    def show_page(self, page):
+        self.page = page
+        self.select.options = self.catalog.options_page(page, self.current_role_id)
+        if self.catalog.page_count > 1:
+            self.select.placeholder = f"Select a rank (page {page + 1}/{self.catalog.page_count})"
+            self.previous_button.disabled = page == 0
+            self.next_button.disabled = page >= self.catalog.page_count - 1
+        else:
+            self.select.placeholder = "Select a rank"
+    
+    async def previous_callback(self, interaction: discord.Interaction):
+        self.show_page(self.page - 1)
+        await interaction.response.edit_message(view=self)
+    
+    async def next_callback(self, interaction: discord.Interaction):
+        self.show_page(self.page + 1)
+        await interaction.response.edit_message(view=self)
+    
+    async def select_callback(self, interaction: discord.Interaction):
+        selected_role = self.catalog.by_id.get(int(self.select.values[0]))
+        await self.on_select(interaction, selected_role)
+
 # Command Group
 @bot.tree.command(name="getrank", description="Get the rank of a user in the group")
-@app_commands.describe(user_identifier="Username or user ID of the Roblox user")
-async def get_rank(interaction: discord.Interaction, user_identifier: str):
-    if not has_permission(interaction, 'ranking_permit') and not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+@app_commands.describe(
+    user_identifier="Username or user ID of the Roblox user",
+    group="Name or ID of the group (defaults to this server's group)"
+)
+@app_commands.autocomplete(user_identifier=user_identifier_autocomplete, group=group_autocomplete)
+@require_permission('ranking_permit')
+async def get_rank(interaction: discord.Interaction, user_identifier: str, group: Optional[str] = None):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=False)
@@ -312,7 +3703,7 @@ async def get_rank(interaction: discord.Interaction, user_identifier: str):
         await interaction.followup.send(f"Couldn't find Roblox user: {user_identifier}")
         return
     
-    rank_info = await bot.roblox_api.get_user_rank(user_id)
+    rank_info = await roblox_group.get_user_rank(user_id)
     if not rank_info:
         await interaction.followup.send(f"{username} (ID: {user_id}) is not a member of the group.")
         return
@@ -324,16 +3715,23 @@ async def get_rank(interaction: discord.Interaction, user_identifier: str):
     )
     embed.add_field(name="Username", value=username, inline=True)
     embed.add_field(name="User ID", value=user_id, inline=True)
+    embed.add_field(name="Group", value=f"{roblox_group.name} ({roblox_group.group_id})", inline=False)
     embed.add_field(name="Rank", value=f"{rank_info['name']} ({rank_info['rank']})", inline=False)
     embed.set_footer(text=f"Requested by {interaction.user.name}")
     
     await interaction.followup.send(embed=embed)
 
 @bot.tree.command(name="rank", description="Rank a user in the group")
-@app_commands.describe(user_identifier="Username or user ID of the Roblox user")
-async def rank_user(interaction: discord.Interaction, user_identifier: str):
-    if not has_permission(interaction, 'ranking_permit') and not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+@app_commands.describe(
+    user_identifier="Username or user ID of the Roblox user",
+    group="Name or ID of the group (defaults to this server's group)"
+)
+@app_commands.autocomplete(user_identifier=user_identifier_autocomplete, group=group_autocomplete)
+@require_permission('ranking_permit')
+async def rank_user(interaction: discord.Interaction, user_identifier: str, group: Optional[str] = None):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=False)
@@ -344,80 +3742,209 @@ async def rank_user(interaction: discord.Interaction, user_identifier: str):
         return
     
     # Check if user is rank banned
-    if str(user_id) in CONFIG['rank_bans']:
-        ban_info = CONFIG['rank_bans'][str(user_id)]
+    ban_info = await bot.store.get_rank_ban(roblox_group.group_id, user_id)
+    if ban_info:
         expiry_date = datetime.datetime.fromtimestamp(ban_info['until']).strftime('%Y-%m-%d %H:%M:%S')
         await interaction.followup.send(f"This user is rank banned until {expiry_date}.")
         return
     
     # Get current user rank
-    current_rank = await bot.roblox_api.get_user_rank(user_id)
+    current_rank = await roblox_group.get_user_rank(user_id)
     if not current_rank:
         await interaction.followup.send(f"{username} (ID: {user_id}) is not a member of the group.")
         return
     
-    # Create a select menu with all group roles
-    select_options = []
+    async def on_select(interaction: discord.Interaction, selected_role):
+        # Queue the rank change; the message is updated once Roblox has applied it
+        previous_job = await bot.rank_jobs.submit(roblox_group.group_id, user_id, selected_role['id'], {
+            'username': username,
+            'previous_rank': current_rank['name'],
+            'role_name': selected_role['name'],
+            'requested_by': interaction.user.name,
+            'requested_by_id': interaction.user.id,
+            'channel_id': interaction.channel_id,
+            'message_id': interaction.message.id
+        })
+        await interaction.response.edit_message(
+            content=f"Ranking {username} to {selected_role['name']}...",
+            view=None
+        )
+        
+        if previous_job and previous_job['context'].get('message_id') != interaction.message.id:
+            try:
+                await bot.edit_job_message(
+                    previous_job['context'],
+                    content=f"Replaced by a newer rank change for {username} from {interaction.user.name}.",
+                    embed=None,
+                    view=None
+                )
+            except discord.HTTPException as e:
+                logger.error(f"Failed to update replaced rank change message: {e}")
     
-    # Sort roles by rank number
-    sorted_roles = sorted(bot.roblox_api.group_roles.values(), key=lambda x: x['rank'])
+    view = RankSelectView(roblox_group.roles, current_rank['id'], on_select)
     
-    for role in sorted_roles:
-        # Add option
-        select_options.append(
-            discord.SelectOption(
-                label=role['name'],
-                description=f"Rank: {role['rank']}",
-                value=str(role['id']),
-                default=role['id'] == current_rank['id']
-            )
-        )
+    await interaction.followup.send(f"Select a rank for {username} (Current rank: {current_rank['name']}):", view=view)
+
+@bot.tree.command(name="bulkrank", description="Rank many users in the group at once")
+@app_commands.describe(
+    users="Usernames or user IDs of the Roblox users, separated by spaces, commas or new lines",
+    role="Name or ID of the role to rank the users to",
+    group="Name or ID of the group (defaults to this server's group)"
+)
+@app_commands.autocomplete(group=group_autocomplete)
+@require_permission('ranking_permit')
+async def bulk_rank(interaction: discord.Interaction, users: str, role: str, group: Optional[str] = None):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
+        return
     
-    # Create the select menu
-    select = discord.ui.Select(
-        placeholder="Select a rank",
-        min_values=1,
-        max_values=1,
-        options=select_options
-    )
+    # Split the user list and drop duplicates while keeping the given order
+    identifiers = list(dict.fromkeys(
+        identifier for identifier in users.replace(',', ' ').split() if identifier
+    ))
+    if not identifiers:
+        await interaction.response.send_message("Please provide at least one username or user ID.", ephemeral=True)
+        return
     
-    view = discord.ui.View(timeout=60)
+    max_users = config_section('bulk_rank')['max_users']
+    if len(identifiers) > max_users:
+        await interaction.response.send_message(f"You can rank at most {max_users} users at once.", ephemeral=True)
+        return
     
-    async def select_callback(interaction: discord.Interaction):
-        selected_role_id = int(select.values[0])
-        selected_role = next((r for r in bot.roblox_api.group_roles.values() if r['id'] == selected_role_id), None)
-        
-        # Set the user's rank
-        success = await bot.roblox_api.set_rank(user_id, selected_role_id)
+    target_role = roblox_group.roles.get(role)
+    if not target_role:
+        await interaction.response.send_message(f"Role '{role}' not found in the group.", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=False)
+    # Let /rank and /getrank from other moderators overtake the bulk change
+    request_priority.set('bulk')
+    
+    results = {}  # identifier -> (status, detail)
+    
+    def build_embed(done):
+        succeeded = sum(1 for status, _ in results.values() if status == 'ranked')
+        failed = len(results) - succeeded
+        embed = discord.Embed(
+            title="Bulk Rank Complete" if done else "Bulk Rank In Progress",
+            description=f"Ranking {len(identifiers)} users to {target_role['name']}",
+            color=discord.Color.green() if done and not failed else (discord.Color.orange() if done else discord.Color.blue()),
+            timestamp=datetime.datetime.now()
+        )
+        embed.add_field(name="Ranked", value=str(succeeded), inline=True)
+        embed.add_field(name="Skipped/Failed", value=str(failed), inline=True)
+        embed.add_field(name="Pending", value=str(len(identifiers) - len(results)), inline=True)
         
-        if success:
-            embed = discord.Embed(
-                title="Rank Update Successful",
-                description=f"Successfully ranked {username} to {selected_role['name']}",
-                color=discord.Color.green(),
-                timestamp=datetime.datetime.now()
-            )
-            embed.add_field(name="Previous Rank", value=current_rank['name'], inline=True)
-            embed.add_field(name="New Rank", value=selected_role['name'], inline=True)
-            embed.set_footer(text=f"Ranked by {interaction.user.name}")
-            
-            await interaction.response.edit_message(content=None, embed=embed, view=None)
-        else:
-            await interaction.response.edit_message(content=f"Failed to set rank for {username}.", view=None)
+        icons = {'ranked': '✅', 'banned': '⛔', 'not_found': '❓', 'duplicate': '🔁', 'failed': '❌'}
+        lines = [
+            f"{icons[status]} {detail}"
+            for status, detail in (results[i] for i in identifiers if i in results)
+            if status != 'ranked'
+        ]
+        if lines:
+            # Keep the listing within Discord's embed field limit
+            listing = ""
+            for index, line in enumerate(lines):
+                if len(listing) + len(line) > 950:
+                    listing += f"...and {len(lines) - index} more"
+                    break
+                listing += line + "\n"
+            embed.add_field(name="Problems", value=listing, inline=False)
+        embed.set_footer(text=f"Ranked by {interaction.user.name}")
+        return embed
     
-    select.callback = select_callback
-    view.add_item(select)
+    message = await interaction.followup.send(embed=build_embed(False), wait=True)
     
-    await interaction.followup.send(f"Select a rank for {username} (Current rank: {current_rank['name']}):", view=view)
+    to_rank = {}  # user_id -> (identifier, username)
+    try:
+        # Resolve every username and user ID in batches
+        resolved = await bot.roblox_api.get_users_info(identifiers)
+        
+        rank_bans = await bot.store.get_rank_bans(roblox_group.group_id, (user_id for _, user_id, _ in resolved if user_id))
+        
+        for identifier, user_id, username in resolved:
+            if not user_id:
+                results[identifier] = ('not_found', f"{identifier}: couldn't find Roblox user")
+            elif user_id in to_rank:
+                # e.g. a username and that user's ID; only the first is ranked
+                results[identifier] = ('duplicate', f"{identifier}: same user as {to_rank[user_id][0]}")
+            elif user_id in rank_bans:
+                expiry_date = datetime.datetime.fromtimestamp(rank_bans[user_id]['until']).strftime('%Y-%m-%d %H:%M:%S')
+                results[identifier] = ('banned', f"{username}: rank banned until {expiry_date}")
+            else:
+                to_rank[user_id] = (identifier, username)
+        
+        def on_result(user_id, success):
+            identifier, username = to_rank[user_id]
+            if success:
+                results[identifier] = ('ranked', username)
+            else:
+                results[identifier] = ('failed', f"{username}: failed to set rank")
+        
+        # Queued /rank changes for these users would otherwise land on top of this one
+        await asyncio.gather(*(
+            bot.rank_jobs.supersede(roblox_group.group_id, user_id, f"a bulk rank change from {interaction.user.name}")
+            for user_id in to_rank
+        ))
+        rank_task = asyncio.ensure_future(
+            roblox_group.set_rank_many(list(to_rank), target_role['id'], on_result=on_result)
+        )
+        
+        # Refresh the progress embed while the rank changes run
+        while not rank_task.done():
+            await asyncio.wait([rank_task], timeout=2)
+            if not rank_task.done():
+                try:
+                    await message.edit(embed=build_embed(False))
+                except discord.HTTPException as e:
+                    logger.error(f"Failed to update bulk rank progress: {e}")
+        
+        await rank_task
+    except Exception as e:
+        # e.g. Roblox unreachable after every retry; whatever wasn't done yet failed
+        logger.error(f"Bulk rank by {interaction.user.name} in group {roblox_group.name} stopped: {e}")
+        for identifier in identifiers:
+            if identifier not in results:
+                results[identifier] = ('failed', f"{identifier}: not ranked, the bulk rank stopped on an error")
+    
+    ranked = [
+        (user_id, username) for user_id, (identifier, username) in to_rank.items()
+        if results.get(identifier, ('failed', None))[0] == 'ranked'
+    ]
+    await bot.audit_log.record_many([
+        AuditLog.make_record(
+            'rank',
+            group_id=roblox_group.group_id,
+            user_id=user_id,
+            username=username,
+            moderator_id=interaction.user.id,
+            moderator=interaction.user.name,
+            to_role=target_role['name'],
+            bulk=True
+        )
+        for user_id, username in ranked
+    ])
+    logger.info(
+        f"{interaction.user.name} bulk ranked {len(ranked)} users to {target_role['name']} in group {roblox_group.name}"
+    )
+    try:
+        await message.edit(embed=build_embed(True))
+    except discord.HTTPException as e:
+        logger.error(f"Failed to show bulk rank results: {e}")
 
 @bot.tree.command(name="rankban", description="Ban a user from being ranked for a period of time")
 @app_commands.describe(
     user_identifier="Username or user ID of the Roblox user",
-    duration="Duration of the ban (e.g., 180d, 24h, 30m, 60s)"
+    duration="Duration of the ban (e.g., 180d, 24h, 30m, 60s)",
+    group="Name or ID of the group (defaults to this server's group)"
 )
-async def rank_ban(interaction: discord.Interaction, user_identifier: str, duration: str):
-    if not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+@app_commands.autocomplete(user_identifier=user_identifier_autocomplete, group=group_autocomplete)
+@require_permission('developer')
+async def rank_ban(interaction: discord.Interaction, user_identifier: str, duration: str, group: Optional[str] = None):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=False)
@@ -437,19 +3964,34 @@ async def rank_ban(interaction: discord.Interaction, user_identifier: str, durat
     expiry_date = datetime.datetime.fromtimestamp(expiry_timestamp).strftime('%Y-%m-%d %H:%M:%S')
     
     # Add rank ban
-    CONFIG['rank_bans'][str(user_id)] = {"until": expiry_timestamp}
-    save_config()
+    await bot.store.add_rank_ban(roblox_group.group_id, user_id, expiry_timestamp)
+    bot.schedule_expiry('rank_ban', roblox_group.group_id, user_id, expiry_timestamp)
+    await bot.audit_log.record(
+        'rank_ban',
+        group_id=roblox_group.group_id,
+        user_id=user_id,
+        username=username,
+        moderator_id=interaction.user.id,
+        moderator=interaction.user.name,
+        until=expiry_timestamp
+    )
     
     await interaction.followup.send(f"Rank banned {username} (ID: {user_id}) until {expiry_date}.")
 
 @bot.tree.command(name="suspend", description="Suspend a user by demoting them temporarily")
 @app_commands.describe(
     user_identifier="Username or user ID of the Roblox user",
-    duration="Duration of the suspension (e.g., 180d, 24h, 30m, 60s)"
+    duration="Duration of the suspension (e.g., 180d, 24h, 30m, 60s)",
+    group="Name or ID of the group (defaults to this server's group)"
 )
-async def suspend_user(interaction: discord.Interaction, user_identifier: str, duration: str):
-    if not has_permission(interaction, 'suspension_permit') and not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+@app_commands.autocomplete(user_identifier=user_identifier_autocomplete, group=group_autocomplete)
+@require_permission('suspension_permit')
+async def suspend_user(
+    interaction: discord.Interaction, user_identifier: str, duration: str, group: Optional[str] = None
+):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=False)
@@ -466,14 +4008,14 @@ async def suspend_user(interaction: discord.Interaction, user_identifier: str, d
         return
     
     # Get current user rank
-    current_rank = await bot.roblox_api.get_user_rank(user_id)
+    current_rank = await roblox_group.get_user_rank(user_id)
     if not current_rank:
         await interaction.followup.send(f"{username} (ID: {user_id}) is not a member of the group.")
         return
     
     # Find suspension rank
-    suspension_rank_name = CONFIG.get('suspension_rank_name', 'Customer')
-    suspension_rank = bot.roblox_api.group_roles.get(suspension_rank_name)
+    suspension_rank_name = roblox_group.suspension_rank_name
+    suspension_rank = roblox_group.roles.get(suspension_rank_name)
     
     if not suspension_rank:
         await interaction.followup.send(f"Suspension rank '{suspension_rank_name}' not found in the group.")
@@ -484,19 +4026,28 @@ async def suspend_user(interaction: discord.Interaction, user_identifier: str, d
         await interaction.followup.send(f"{username} is already at or below the suspension rank.")
         return
     
-    # Set the user's rank to the suspension rank
-    success = await bot.roblox_api.set_rank(user_id, suspension_rank['id'])
+    # Set the user's rank to the suspension rank, replacing any queued /rank change
+    await bot.rank_jobs.supersede(roblox_group.group_id, user_id, f"a suspension from {interaction.user.name}")
+    success = await roblox_group.set_rank(user_id, suspension_rank['id'])
     
     if success:
         expiry_timestamp = datetime.datetime.now().timestamp() + duration_seconds
         expiry_date = datetime.datetime.fromtimestamp(expiry_timestamp).strftime('%Y-%m-%d %H:%M:%S')
         
         # Store suspension info
-        CONFIG['suspensions'][str(user_id)] = {
-            "until": expiry_timestamp,
-            "original_rank": current_rank['id']
-        }
-        save_config()
+        await bot.store.add_suspension(roblox_group.group_id, user_id, expiry_timestamp, current_rank['id'])
+        bot.schedule_expiry('suspension', roblox_group.group_id, user_id, expiry_timestamp)
+        await bot.audit_log.record(
+            'suspend',
+            group_id=roblox_group.group_id,
+            user_id=user_id,
+            username=username,
+            moderator_id=interaction.user.id,
+            moderator=interaction.user.name,
+            from_role=current_rank['name'],
+            to_role=suspension_rank['name'],
+            until=expiry_timestamp
+        )
         
         embed = discord.Embed(
             title="User Suspended",
@@ -512,83 +4063,412 @@ async def suspend_user(interaction: discord.Interaction, user_identifier: str, d
     else:
         await interaction.followup.send(f"Failed to suspend {username}.")
 
+AUDIT_ACTIONS = {
+    'rank': "Ranked",
+    'rank_ban': "Rank banned",
+    'rank_ban_expired': "Rank ban expired",
+    'suspend': "Suspended",
+    'restore': "Restored",
+    'restore_skipped': "Restore skipped",
+    'shout': "Group shout"
+}
+
+def format_audit_record(record):
+    """Describe an audit record in one line of /history"""
+    # Discord renders <t:...> timestamps in each reader's own timezone
+    parts = [f"<t:{int(record['ts'])}:f>", AUDIT_ACTIONS.get(record['action'], record['action'])]
+    if record.get('user_id') is not None:
+        parts.append(f"{record.get('username') or 'User'} ({record['user_id']})")
+    if record.get('to_role'):
+        parts.append(f"{record['from_role']} → {record['to_role']}" if record.get('from_role') else f"to {record['to_role']}")
+    if record.get('until'):
+        parts.append(f"until <t:{int(record['until'])}:f>")
+    if record.get('reason'):
+        parts.append(record['reason'])
+    if record['action'] == 'shout':
+        parts.append(f'"{record["message"][:100]}"' if record.get('message') else "cleared")
+    group = bot.roblox_api.group_by_id(record.get('group_id'))
+    if group and len(bot.roblox_api.groups) > 1:
+        parts.append(f"in {group.name}")
+    parts.append(f"by {record.get('moderator') or 'the bot'}")
+    return " · ".join(parts)
+
+class HistoryView(discord.ui.View):
+    """Newer/Older buttons paging through audit log results"""
+    
+    def __init__(self, title, fetch_page, timeout=300):
+        super().__init__(timeout=timeout)
+        self.title = title
+        self.fetch_page = fetch_page  # Coroutine function (before) -> (records, cursor of the next older page)
+        self.cursors = [None]  # The before cursor of every page up to the one shown
+        self.records = []
+        self.next_cursor = None
+        
+        self.newer_button = discord.ui.Button(label="Newer", style=discord.ButtonStyle.secondary)
+        self.newer_button.callback = self.newer_callback
+        self.older_button = discord.ui.Button(label="Older", style=discord.ButtonStyle.secondary)
+        self.older_button.callback = self.older_callback
+        self.add_item(self.newer_button)
+        self.add_item(self.older_button)
+    
+    async def load(self):
+        self.records, self.next_cursor = await self.fetch_page(self.cursors[-1])
+    
+    def build_embed(self):
+        self.newer_button.disabled = len(self.cursors) <= 1
+        self.older_button.disabled = self.next_cursor is None
+        embed = discord.Embed(
+            title=self.title,
+            description="\n".join(format_audit_record(record) for record in self.records) or "No matching records.",
+            color=discord.Color.blue()
+        )
+        embed.set_footer(text=f"Page {len(self.cursors)}")
+        return embed
+    
+    async def newer_callback(self, interaction: discord.Interaction):
+        self.cursors.pop()
+        await self.load()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+    
+    async def older_callback(self, interaction: discord.Interaction):
+        self.cursors.append(self.next_cursor)
+        await self.load()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+@bot.tree.command(name="history", description="Show the audit log for a Roblox user or a moderator")
+@app_commands.describe(
+    user_identifier="Username or user ID of the Roblox user",
+    moderator="Discord user whose actions to show"
+)
+@app_commands.autocomplete(user_identifier=user_identifier_autocomplete)
+@require_permission('ranking_permit')
+async def history(
+    interaction: discord.Interaction, user_identifier: Optional[str] = None, moderator: Optional[discord.User] = None
+):
+    await interaction.response.defer(ephemeral=True)
+    
+    user_id = None
+    title = "Audit Log"
+    if user_identifier:
+        user_id, username = await bot.roblox_api.get_user_info(user_identifier)
+        if not user_id:
+            await interaction.followup.send(f"Couldn't find Roblox user: {user_identifier}")
+            return
+        title += f" for {username} ({user_id})"
+    if moderator:
+        title += f" by {moderator.name}"
+    
+    page_size = config_section('audit_log')['page_size']
+    
+    async def fetch_page(before):
+        return await bot.audit_history.query(
+            user_id=user_id,
+            moderator_id=moderator.id if moderator else None,
+            before=before,
+            limit=page_size
+        )
+    
+    view = HistoryView(title, fetch_page)
+    await view.load()
+    await interaction.followup.send(embed=view.build_embed(), view=view)
+
 @bot.tree.command(name="groupshout", description="Set the group shout message")
-@app_commands.describe(message="The message to set as the group shout")
-async def group_shout(interaction: discord.Interaction, message: str):
-    if not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+@app_commands.describe(
+    message="The message to set as the group shout",
+    group="Name or ID of the group (defaults to this server's group)"
+)
+@app_commands.autocomplete(group=group_autocomplete)
+@require_permission('developer')
+async def group_shout(interaction: discord.Interaction, message: str, group: Optional[str] = None):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=False)
     
-    success = await bot.roblox_api.set_group_shout(message)
+    success = await roblox_group.set_group_shout(message)
     
     if success:
+        await bot.audit_log.record(
+            'shout',
+            group_id=roblox_group.group_id,
+            moderator_id=interaction.user.id,
+            moderator=interaction.user.name,
+            message=message
+        )
         await interaction.followup.send(f"Group shout updated successfully!")
     else:
         await interaction.followup.send("Failed to update group shout.")
 
 @bot.tree.command(name="cleargroupshout", description="Clear the group shout message")
-async def clear_group_shout(interaction: discord.Interaction):
-    if not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+@app_commands.describe(group="Name or ID of the group (defaults to this server's group)")
+@app_commands.autocomplete(group=group_autocomplete)
+@require_permission('developer')
+async def clear_group_shout(interaction: discord.Interaction, group: Optional[str] = None):
+    roblox_group = resolve_group(interaction, group)
+    if not roblox_group:
+        await interaction.response.send_message(f"Unknown group: {group}", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=False)
     
-    success = await bot.roblox_api.clear_group_shout()
+    success = await roblox_group.clear_group_shout()
     
     if success:
+        await bot.audit_log.record(
+            'shout',
+            group_id=roblox_group.group_id,
+            moderator_id=interaction.user.id,
+            moderator=interaction.user.name,
+            message=""
+        )
         await interaction.followup.send("Group shout cleared successfully!")
     else:
         await interaction.followup.send("Failed to clear group shout.")
 
 @bot.tree.command(name="setbotplaying", description="Set the bot's playing status")
 @app_commands.describe(message="The message to set as the bot's playing status")
+@require_permission('developer')
 async def set_bot_playing(interaction: discord.Interaction, message: str):
-    if not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
-        return
-    
     await bot.change_presence(activity=discord.Game(name=message))
     await interaction.response.send_message(f"Bot status updated to: Playing {message}")
 
 @bot.tree.command(name="resetbot", description="Reset the bot's status and refresh the Roblox API session")
+@require_permission('developer')
 async def reset_bot(interaction: discord.Interaction):
-    if not has_permission(interaction, 'developer'):
-        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
-        return
-    
     await interaction.response.defer(ephemeral=False)
     
-    # Close the current session
-    await bot.roblox_api.close()
-    
-    # Reinitialize
+    # Rebuild the session on the existing connection pool and reinitialize
     try:
-        await bot.roblox_api.initialize()
+        await bot.roblox_api.rebuild_session()
         await bot.change_presence(activity=discord.Game(name="/rank | Roblox Ranking"))
         await interaction.followup.send("Bot reset successfully. Roblox API session refreshed.")
     except Exception as e:
         logger.error(f"Error resetting bot: {e}")
         await interaction.followup.send(f"Failed to reset bot: {str(e)}")
 
+@bot.tree.command(name="reloadconfig", description="Reload the config file and apply what changed without restarting")
+@require_permission('developer')
+async def reload_config(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        applied, needs_restart = await bot.reload_config()
+    except Exception as e:
+        logger.error(f"Error reloading config: {e}")
+        await interaction.followup.send(f"Config not reloaded: {e}")
+        return
+    
+    if not applied and not needs_restart:
+        await interaction.followup.send("Config reloaded, nothing changed.")
+        return
+    embed = discord.Embed(
+        title="Config Reloaded",
+        color=discord.Color.green() if not needs_restart else discord.Color.orange(),
+        timestamp=datetime.datetime.now()
+    )
+    if applied:
+        embed.add_field(name="Applied", value=", ".join(applied), inline=False)
+    if needs_restart:
+        embed.add_field(name="Takes effect after a restart", value=", ".join(needs_restart), inline=False)
+    embed.set_footer(text=f"Reloaded by {interaction.user.name}")
+    await interaction.followup.send(embed=embed)
+
+@bot.tree.command(name="diagnostics", description="Show event loop health and optionally profile the bot")
+@app_commands.describe(
+    monitor="Turn event loop lag and slow callback monitoring on or off",
+    profile_seconds="Sample the bot's stack for this many seconds and attach the profile"
+)
+@require_permission('developer')
+async def diagnostics(interaction: discord.Interaction, monitor: Optional[bool] = None, profile_seconds: Optional[int] = None):
+    await interaction.response.defer(ephemeral=True)
+    
+    if monitor is True:
+        bot.loop_monitor.start()
+    elif monitor is False:
+        bot.loop_monitor.stop()
+    
+    profile = None
+    if profile_seconds:
+        seconds = max(1, min(profile_seconds, config_section('diagnostics')['max_profile_seconds']))
+        stacks = await bot.loop_monitor.profile(seconds)
+        profile = bot.loop_monitor.summarize_profile(stacks)
+        folded = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        profile_file = discord.File(io.BytesIO(folded.encode()), filename=f"profile-{int(time.time())}.folded")
+    
+    monitor_stats = bot.loop_monitor.stats()
+    embed = discord.Embed(
+        title="Diagnostics",
+        color=discord.Color.blue(),
+        timestamp=datetime.datetime.now()
+    )
+    if monitor_stats['lag_last'] is not None:
+        lag = (
+            f"Last: {monitor_stats['lag_last'] * 1000:.1f}ms | p50: {monitor_stats['lag_p50'] * 1000:.1f}ms | "
+            f"p99: {monitor_stats['lag_p99'] * 1000:.1f}ms | Max: {monitor_stats['lag_max'] * 1000:.1f}ms"
+        )
+    else:
+        lag = "No measurements yet"
+    embed.add_field(
+        name=f"Event Loop ({'monitoring' if monitor_stats['enabled'] else 'not monitoring'})",
+        value=f"{lag}\nTasks: {len(asyncio.all_tasks())}",
+        inline=False
+    )
+    slow_callbacks = "\n".join(
+        f"<t:{int(timestamp)}:T> {description[:150]}"
+        for timestamp, description in monitor_stats['recent_slow_callbacks'][-5:]
+    )
+    embed.add_field(
+        name=f"Slow Callbacks ({monitor_stats['slow_callbacks']})",
+        value=slow_callbacks or "None recorded",
+        inline=False
+    )
+    shard_latencies = ", ".join(
+        f"{shard_id}: {latency * 1000:.0f}ms" for shard_id, latency in bot.latencies if not math.isnan(latency)
+    )
+    embed.add_field(name="Gateway Latency", value=shard_latencies or "Not connected", inline=False)
+    
+    if profile is None:
+        await interaction.followup.send(embed=embed)
+        return
+    top = "\n".join(f"{count} {frame[:100]}" for frame, count in profile['top']) or "Idle the whole time"
+    embed.add_field(
+        name=f"Profile ({seconds}s, {profile['samples']} samples, {profile['busy']:.0%} busy)",
+        value=f"```\n{top[:1000]}\n```",
+        inline=False
+    )
+    await interaction.followup.send(embed=embed, file=profile_file)
+
+@bot.tree.command(name="apistats", description="Show Roblox API cache, rate limit and restore queue statistics")
+@require_permission('developer')
+async def api_stats(interaction: discord.Interaction):
+    cache_stats = bot.roblox_api.user_cache.stats()
+    
+    embed = discord.Embed(
+        title="Roblox API Statistics",
+        color=discord.Color.blue(),
+        timestamp=datetime.datetime.now()
+    )
+    embed.add_field(
+        name="User Cache",
+        value=(
+            f"Entries: {cache_stats['size']}/{cache_stats['max_size']}\n"
+            f"Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} | Coalesced: {cache_stats['coalesced']}\n"
+            f"In flight: {cache_stats['inflight']} | Hit rate: {cache_stats['hit_rate']:.1%}"
+        ),
+        inline=False
+    )
+    job_stats = bot.rank_jobs.stats()
+    embed.add_field(
+        name="Rank Change Queue",
+        value=(
+            f"Queued: {job_stats['queued']} | In progress: {job_stats['in_progress']} | "
+            f"Waiting to retry: {job_stats['waiting_retry']}\n"
+            f"Completed: {job_stats['completed']} | Failed: {job_stats['failed']} | Superseded: {job_stats['superseded']}"
+        ),
+        inline=False
+    )
+    restore_stats = bot.restore_pipeline.stats()
+    embed.add_field(
+        name="Suspension Restores",
+        value=(
+            f"Queued: {restore_stats['queued']} | In progress: {restore_stats['in_progress']} | "
+            f"Waiting to retry: {restore_stats['waiting_retry']}\n"
+            f"Restored: {restore_stats['restored']} ({restore_stats['per_minute']}/min) | "
+            f"Failures: {restore_stats['failures']} | Dropped: {restore_stats['dropped']} | "
+            f"Skipped: {restore_stats['skipped']}"
+        ),
+        inline=False
+    )
+    if bot.reconciler:
+        reconcile_stats = bot.reconciler.stats()
+        counts = await bot.store.counts()
+        last_run = f"<t:{int(reconcile_stats['last_run'])}:R>" if reconcile_stats['last_run'] else "never"
+        embed.add_field(
+            name="Suspension Reconciliation",
+            value=(
+                f"Last run: {last_run} ({reconcile_stats['checked']} checked) | "
+                f"Drifted now: {counts['drifted_suspensions']}\n"
+                f"Marked: {reconcile_stats['drifted']} | Cleared: {reconcile_stats['cleared']} | "
+                f"Requests: {reconcile_stats['requests']}"
+            ),
+            inline=False
+        )
+    for roblox_group in bot.roblox_api.groups.values():
+        if not roblox_group.roster:
+            continue
+        roster_stats = roblox_group.roster.stats()
+        age = f"{roster_stats['age']:.0f}s ago" if roster_stats['age'] is not None else "never"
+        embed.add_field(
+            name=f"Roster Mirror ({roblox_group.name})",
+            value=(
+                f"Members: {roster_stats['members']} in {roster_stats['roles']} roles\n"
+                f"Last refresh: {age} ({'fresh' if roster_stats['fresh'] else 'stale'})"
+            ),
+            inline=False
+        )
+    if config_section('http')['trace']:
+        connection_stats = bot.roblox_api.connection_stats
+        embed.add_field(
+            name="Connections",
+            value=(
+                f"New: {connection_stats['created']} | Reused: {connection_stats['reused']}\n"
+                f"DNS cache hits: {connection_stats['dns_hits']} | Misses: {connection_stats['dns_misses']}"
+            ),
+            inline=False
+        )
+    if bot.leader_lease:
+        lease = await bot.store.get_lease(bot.leader_lease.name)
+        embed.add_field(
+            name="Cluster",
+            value=(
+                f"Worker: {bot.worker_id} ({'leader' if bot.is_leader else 'follower'}) | Shards: {bot.shard_ids or 'all'}\n"
+                f"Leader: {lease['holder'] if lease else 'none'}"
+            ),
+            inline=False
+        )
+    audit_stats = bot.audit_log.stats()
+    embed.add_field(
+        name="Audit Log",
+        value=(
+            f"Records: {audit_stats['records']} | Segment: {audit_stats['segment']} | "
+            f"Users: {audit_stats['users']} | Moderators: {audit_stats['moderators']}"
+        ),
+        inline=False
+    )
+    embed.add_field(name="CSRF Rotations", value=str(bot.roblox_api.csrf_rotations), inline=False)
+    for family, state in bot.roblox_api.rate_limit_state().items():
+        embed.add_field(
+            name=f"{family} rate limit",
+            value=(
+                f"Tokens: {state['tokens']:.1f}/{state['burst']} ({state['rate']}/s)\n"
+                f"Blocked for: {state['blocked_for']:.1f}s\n"
+                f"Throttled: {state['throttled']} | 429s: {state['rate_limited']}\n"
+                f"Waiting: {', '.join(f'{waiting} {priority}' for priority, waiting in state['waiting'].items())}\n"
+                f"Expired: {sum(state['expired'].values())}"
+            ),
+            inline=True
+        )
+    embed.set_footer(text=f"Requested by {interaction.user.name}")
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # Run the bot
 def main():
     try:
+        if CONFIG_CREATED:
+            print(f"Config file created! Please fill in your details in {CONFIG_PATH} before running the bot again.")
+            return
         bot.run(CONFIG['token'])
     except Exception as e:
         logger.error(f"Error running bot: {e}")
     finally:
-        # Ensure we close the API session
-        if bot.roblox_api and bot.roblox_api.session:
-            asyncio.run(bot.roblox_api.close())
-
-
-@bot.event
-async def on_ready():
-    synced = await bot.tree.sync()
-    print(f"Bot is ready! Synced {len(synced)} commands.")
+        # The API session is closed by bot.close() while the event loop is still running
+        bot.store.close()
+        if bot.audit_history is not bot.audit_log:
+            bot.audit_history.close()
+        bot.audit_log.close()
 
 if __name__ == "__main__":
     main()
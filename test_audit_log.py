@@ -0,0 +1,215 @@
+import os
+
+from main import AuditIndex, AuditLog, AuditLogSet
+
+
+def append(log, ts, **fields):
+    log._append([AuditLog.make_record('rank', group_id=1, ts=ts, **fields)])
+
+
+def fetch_all(log, **filters):
+    """Follow the cursors through every page and return the ts of each record"""
+    seen = []
+    before = None
+    while True:
+        records, before = log._query(filters.get('user_id'), filters.get('moderator_id'), before, 3)
+        seen += [record['ts'] for record in records]
+        if before is None:
+            return seen
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith('segment-'))
+
+
+def test_query_pages_newest_first_by_user_and_moderator(tmp_path):
+    log = AuditLog(str(tmp_path))
+    for ts in range(20):
+        append(log, ts, user_id=ts % 2, moderator_id=100 + ts % 3)
+
+    assert fetch_all(log) == list(range(19, -1, -1))
+    assert fetch_all(log, user_id=1) == [ts for ts in range(19, -1, -1) if ts % 2]
+    assert fetch_all(log, moderator_id=100) == [ts for ts in range(19, -1, -1) if ts % 3 == 0]
+    assert fetch_all(log, user_id=0, moderator_id=101) == [ts for ts in range(19, -1, -1) if ts % 2 == 0 and ts % 3 == 1]
+    assert log._query(5, None, None, 10) == ([], None)
+    log.close()
+
+
+def test_segments_roll_over_and_survive_reopening(tmp_path):
+    log = AuditLog(str(tmp_path), segment_size=200)
+    for ts in range(30):
+        append(log, ts, user_id=7, username=f"User{ts}")
+    log.close()
+    assert len(segment_files(tmp_path)) > 1
+
+    log = AuditLog(str(tmp_path), segment_size=200)
+    assert fetch_all(log, user_id=7) == list(range(29, -1, -1))
+    append(log, 30, user_id=7)
+    assert log._query(7, None, None, 1)[0][0]['ts'] == 30
+    log.close()
+
+
+def test_recovery_indexes_records_missing_from_the_index(tmp_path):
+    log = AuditLog(str(tmp_path))
+    for ts in range(10):
+        append(log, ts, user_id=ts % 2, moderator_id=100)
+    log.close()
+    # A crash after the records were written but before (all of) their index entries were
+    for name, lost in (('all', 3), ('user', 5)):
+        path = tmp_path / f'{name}.idx'
+        os.truncate(path, os.path.getsize(path) - lost * AuditIndex.ENTRY.size - 7)
+
+    log = AuditLog(str(tmp_path))
+    assert log.stats()['records'] == 10
+    assert fetch_all(log) == list(range(9, -1, -1))
+    assert fetch_all(log, user_id=1) == [9, 7, 5, 3, 1]
+    assert fetch_all(log, moderator_id=100) == list(range(9, -1, -1))
+    log.close()
+
+
+def test_recovery_cuts_off_a_torn_record_at_the_end_of_a_segment(tmp_path):
+    log = AuditLog(str(tmp_path))
+    for ts in range(5):
+        append(log, ts, user_id=1)
+    log.close()
+    segment = tmp_path / segment_files(tmp_path)[-1]
+    size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(AuditLog.FRAME.pack(500, 0) + b'partial')
+
+    log = AuditLog(str(tmp_path))
+    assert os.path.getsize(segment) == size
+    append(log, 5, user_id=1)
+    assert fetch_all(log, user_id=1) == [5, 4, 3, 2, 1, 0]
+    log.close()
+
+
+def test_recovery_drops_index_entries_for_a_torn_indexed_record(tmp_path):
+    log = AuditLog(str(tmp_path))
+    for ts in range(6):
+        append(log, ts, user_id=1, moderator_id=100)
+    _, segment, offset, _ = log.indexes['all'].entry(5)
+    log.close()
+    # Every index points at record 5, but only part of it reached the disk
+    os.truncate(tmp_path / segment_files(tmp_path)[-1], offset + AuditLog.FRAME.size + 2)
+
+    log = AuditLog(str(tmp_path))
+    for name in ('all', 'user', 'moderator'):
+        assert log.indexes[name].count == 5
+    assert os.path.getsize(tmp_path / segment_files(tmp_path)[-1]) == offset
+    append(log, 6, user_id=1, moderator_id=100)
+    assert fetch_all(log) == [6, 4, 3, 2, 1, 0]
+    assert fetch_all(log, user_id=1) == [6, 4, 3, 2, 1, 0]
+    assert fetch_all(log, moderator_id=100) == [6, 4, 3, 2, 1, 0]
+    log.close()
+
+
+def test_query_skips_a_damaged_record(tmp_path):
+    log = AuditLog(str(tmp_path))
+    for ts in range(6):
+        append(log, ts, user_id=1)
+    _, segment, offset, _ = log.indexes['all'].entry(3)
+    with open(tmp_path / segment_files(tmp_path)[-1], 'r+b') as f:
+        f.seek(offset + AuditLog.FRAME.size)
+        byte = f.read(1)
+        f.seek(offset + AuditLog.FRAME.size)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    assert fetch_all(log) == [5, 4, 2, 1, 0]
+    assert fetch_all(log, user_id=1) == [5, 4, 2, 1, 0]
+    log.close()
+
+
+def test_recovery_drops_index_entries_pointing_past_the_log(tmp_path):
+    log = AuditLog(str(tmp_path))
+    append(log, 0, user_id=1)
+    log.close()
+    # Index entries pointing into a segment that doesn't exist
+    with open(tmp_path / 'user.idx', 'ab') as f:
+        f.write(AuditIndex.ENTRY.pack(2, 99, 0, 0))
+
+    log = AuditLog(str(tmp_path))
+    append(log, 1, user_id=2)
+    assert fetch_all(log) == [1, 0]
+    log.close()
+
+
+def test_index_truncate_points_heads_back_at_older_entries(tmp_path):
+    index = AuditIndex(str(tmp_path / 'test.idx'))
+    for number, key in enumerate((1, 2, 1, 3, 1)):
+        index.append(key, 1, number * 10)
+    index.truncate(3)
+
+    assert index.count == 3
+    assert index.heads == {1: 2, 2: 1}
+    assert list(index.chain(1)) == [2, 0]
+    assert os.path.getsize(tmp_path / 'test.idx') == 3 * AuditIndex.ENTRY.size
+    assert index.append(1, 1, 30) == 3
+    assert list(index.chain(1)) == [3, 2, 0]
+    index.close()
+
+
+def test_read_only_index_picks_up_appends_and_truncation(tmp_path):
+    writer = AuditIndex(str(tmp_path / 'test.idx'))
+    writer.append(1, 1, 0)
+    reader = AuditIndex(str(tmp_path / 'test.idx'), readonly=True)
+    assert reader.heads == {1: 0}
+
+    writer.append(1, 1, 10)
+    writer.append(2, 1, 20)
+    reader.refresh()
+    assert reader.heads == {1: 1, 2: 2}
+    assert list(reader.chain(1)) == [1, 0]
+
+    writer.truncate(1)
+    reader.refresh()
+    assert reader.count == 1
+    assert reader.heads == {1: 0}
+    writer.close()
+    reader.close()
+
+
+def test_log_set_merges_every_workers_log_by_time(tmp_path):
+    first = AuditLog(str(tmp_path / 'worker-1'))
+    second = AuditLog(str(tmp_path / 'worker-2'))
+    for ts in range(20):
+        append(first if ts % 3 else second, ts, user_id=ts % 2, moderator_id=100)
+    logs = AuditLogSet(first, str(tmp_path))
+
+    assert fetch_all(logs) == list(range(19, -1, -1))
+    assert fetch_all(logs, user_id=1) == [ts for ts in range(19, -1, -1) if ts % 2]
+    assert fetch_all(logs, user_id=0, moderator_id=100) == [ts for ts in range(19, -1, -1) if ts % 2 == 0]
+
+    # Records the other worker writes later, and workers that start later, are picked up
+    append(second, 20, user_id=1)
+    third = AuditLog(str(tmp_path / 'worker-3'))
+    append(third, 21, user_id=1)
+    assert [record['ts'] for record in logs._query(1, None, None, 2)[0]] == [21, 20]
+
+    logs.close()
+    for log in (first, second, third):
+        log.close()
+
+
+def test_log_set_cursor_resumes_each_log_where_its_page_stopped(tmp_path):
+    first = AuditLog(str(tmp_path / 'worker-1'))
+    second = AuditLog(str(tmp_path / 'worker-2'))
+    # Every newer record is in the first log, so the second log's page isn't used at all
+    for ts in range(4):
+        append(second, ts, user_id=1)
+    for ts in range(4, 10):
+        append(first, ts, user_id=1)
+    logs = AuditLogSet(first, str(tmp_path))
+
+    records, cursor = logs._query(None, None, None, 4)
+    assert [record['ts'] for record in records] == [9, 8, 7, 6]
+    assert cursor == {'worker-1': 2, 'worker-2': None}
+    records, cursor = logs._query(None, None, cursor, 4)
+    assert [record['ts'] for record in records] == [5, 4, 3, 2]
+    records, cursor = logs._query(None, None, cursor, 4)
+    assert [record['ts'] for record in records] == [1, 0]
+    assert cursor is None
+
+    logs.close()
+    first.close()
+    second.close()
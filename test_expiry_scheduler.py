@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from main import ExpiryScheduler
+
+
+def run_scheduler(scheduler, setup, seconds):
+    """Run the scheduler for a while after setup(scheduler) has scheduled its deadlines"""
+    async def run():
+        scheduler.start()
+        setup(scheduler)
+        await asyncio.sleep(seconds)
+        scheduler.stop()
+    asyncio.run(run())
+
+
+def test_due_deadlines_reach_the_handler_in_order():
+    calls = []
+
+    async def handler(due):
+        calls.append([key[:3] for key in due])
+
+    def setup(scheduler):
+        now = time.time()
+        scheduler.schedule('suspension', 1, 2, now - 10)
+        scheduler.schedule('rank_ban', 1, 1, now - 20)
+        scheduler.schedule('suspension', 1, 3, now + 3600)
+
+    scheduler = ExpiryScheduler(handler)
+    run_scheduler(scheduler, setup, 0.1)
+    assert calls == [[('rank_ban', 1, 1), ('suspension', 1, 2)]]
+    assert len(scheduler) == 1
+
+
+def test_earlier_deadline_wakes_the_sleeper_and_replaced_ones_are_skipped():
+    calls = []
+
+    async def handler(due):
+        calls.append([key[:3] for key in due])
+
+    def setup(scheduler):
+        now = time.time()
+        scheduler.schedule('suspension', 1, 1, now + 3600)
+        scheduler.schedule('suspension', 1, 2, now + 0.05)
+        # Moved to later, then cancelled: neither deadline may fire
+        scheduler.schedule('suspension', 1, 1, now + 0.05)
+        scheduler.schedule('suspension', 1, 1, now + 3600)
+        scheduler.schedule('rank_ban', 1, 3, now + 0.05)
+        scheduler.cancel('rank_ban', 1, 3)
+
+    scheduler = ExpiryScheduler(handler)
+    run_scheduler(scheduler, setup, 0.3)
+    assert calls == [[('suspension', 1, 2)]]
+    assert len(scheduler) == 1
+
+
+def test_deadlines_are_retried_after_the_handler_fails(monkeypatch):
+    monkeypatch.setattr(ExpiryScheduler, 'RETRY_DELAY', 0.1)
+    calls = []
+
+    async def handler(due):
+        calls.append([key[:3] for key in due])
+        if len(calls) == 1:
+            raise Exception("database is locked")
+
+    def setup(scheduler):
+        scheduler.schedule('suspension', 1, 1, time.time() - 1)
+
+    scheduler = ExpiryScheduler(handler)
+    run_scheduler(scheduler, setup, 0.4)
+    assert calls == [[('suspension', 1, 1)], [('suspension', 1, 1)]]
+    assert len(scheduler) == 0
+
+
+def test_retry_does_not_replace_a_deadline_set_meanwhile(monkeypatch):
+    monkeypatch.setattr(ExpiryScheduler, 'RETRY_DELAY', 0.1)
+    calls = []
+    later = time.time() + 3600
+
+    async def handler(due):
+        calls.append([key[:3] for key in due])
+        # e.g. the suspension was extended while the failing sweep ran
+        scheduler.schedule('suspension', 1, 1, later)
+        raise Exception("database is locked")
+
+    def setup(scheduler):
+        scheduler.schedule('suspension', 1, 1, time.time() - 1)
+
+    scheduler = ExpiryScheduler(handler)
+    run_scheduler(scheduler, setup, 0.4)
+    assert calls == [[('suspension', 1, 1)]]
+    assert scheduler.next_deadline() == later
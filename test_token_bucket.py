@@ -0,0 +1,95 @@
+import asyncio
+from collections import Counter
+
+from main import TokenBucket
+
+WEIGHTS = {'interactive': 16, 'bulk': 4, 'background': 1}
+
+
+def drained_bucket(rate=2000):
+    """A bucket with no tokens left, so every request has to queue"""
+    bucket = TokenBucket('test', rate=rate, burst=1, weights=WEIGHTS)
+    bucket.tokens = 0
+    return bucket
+
+
+async def queue_requests(bucket, counts, order):
+    """Start acquire() for counts[priority] requests of each class, recording the grant order"""
+    async def request(priority):
+        assert await bucket.acquire(priority)
+        order.append(priority)
+    return [
+        asyncio.ensure_future(request(priority))
+        for priority, count in counts.items()
+        for _ in range(count)
+    ]
+
+
+def test_tokens_are_granted_straight_away_while_available():
+    async def run():
+        bucket = TokenBucket('test', rate=1, burst=3, weights=WEIGHTS)
+        assert [await bucket.acquire('background') for _ in range(3)] == [True, True, True]
+        assert bucket.throttled == 0
+        assert bucket.granted['background'] == 3
+    asyncio.run(run())
+
+
+def test_waiting_classes_share_tokens_by_weight():
+    async def run():
+        bucket = drained_bucket()
+        # Hold every grant back until all requests are queued
+        bucket.block_for(0.05)
+        order = []
+        tasks = await queue_requests(bucket, {'background': 40, 'bulk': 40, 'interactive': 40}, order)
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    first = Counter(order[:42])
+    assert first['interactive'] == 32
+    assert first['bulk'] == 8
+    assert first['background'] == 2
+    assert Counter(order) == {'interactive': 40, 'bulk': 40, 'background': 40}
+
+
+def test_idle_class_does_not_save_up_turns():
+    async def run():
+        bucket = drained_bucket(rate=1000)
+        order = []
+        interactive = await queue_requests(bucket, {'interactive': 40}, order)
+        await asyncio.gather(*interactive[:20])
+        background = await queue_requests(bucket, {'background': 10}, order)
+        await asyncio.gather(*interactive, *background)
+        return order
+
+    order = asyncio.run(run())
+    # Background only joined after 20 interactive grants, which it must not be owed
+    after_join = Counter(order[20:37])
+    assert after_join['background'] <= 2
+
+
+def test_acquire_gives_up_after_its_timeout():
+    async def run():
+        bucket = drained_bucket(rate=1)
+        assert await bucket.acquire('interactive', timeout=0.05) is False
+        assert await bucket.acquire('interactive', timeout=0) is False
+        assert bucket.expired['interactive'] == 2
+        assert bucket.state()['waiting']['interactive'] == 0
+    asyncio.run(run())
+
+
+def test_unknown_priority_counts_as_background():
+    async def run():
+        bucket = TokenBucket('test', rate=1, burst=1, weights=WEIGHTS)
+        assert await bucket.acquire('nonsense')
+        assert bucket.granted['background'] == 1
+    asyncio.run(run())
+
+
+def test_blocked_bucket_waits_out_the_block():
+    async def run():
+        bucket = TokenBucket('test', rate=1000, burst=5, weights=WEIGHTS)
+        bucket.update_from_headers({'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '0.2'})
+        assert await bucket.acquire('interactive', timeout=0.05) is False
+        assert await bucket.acquire('interactive', timeout=1) is True
+    asyncio.run(run())